@@ -2,15 +2,57 @@
 # -*- coding: UTF-8 -*-
 
 import os
+import re
 import sys
+import io
+import time
+import csv
+import json
 import getopt
-import xlwt
-from datetime import datetime
+import heapq
+import sqlite3
+import itertools
+import subprocess
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+
+try:
+	import xlwt
+except ImportError:
+	xlwt = None
+
+try:
+	import openpyxl
+	from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+except ImportError:
+	openpyxl = None
+
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+try:
+	import pygit2
+except ImportError:
+	pygit2 = None
 
 VERSION="v2024.11.28"
 report_file="submission.xlsx"
 input_file = ""
 author = ""
+since = "2017"
+backend = "git"
+jobs = 1
+cache_file = ""
+
+#git log is asked for a machine-delimited format: every commit starts with
+#RECORD_SEP and its fields are split by FIELD_SEP, followed by the numstat lines
+RECORD_SEP = "\x1e"
+FIELD_SEP = "\x00"
+LOG_FORMAT = "%x1e%H%x00%an <%ae>%x00%aI%x00%cI%x00%s%x00%b%x00"
 
 def usage():
 	"""
@@ -19,22 +61,715 @@ Usage:
 # cd <path of repository with kernel>
 # ./parse_git_message.py -a <xxx@xxx.com>
 
+The git log is read through a pipe and parsed commit by commit, so memory
+stays flat no matter how much history there is.
+
 or indicate the git message file
 # ./parse_git_message.py -i log.txt
 
+the input file is either the old "git log --stat" text or the record format:
+# git log --no-merges --numstat --format="%x1e%H%x00%an <%ae>%x00%aI%x00%cI%x00%s%x00%b%x00" > log.txt
+
 Note: This script is depend on xlwt library, install cmd is "pip3 install xlwt"
+the output is selected by the extension of the report file: .xls (xlwt),
+.xlsx (openpyxl, written in constant memory), .csv and .parquet (pyarrow),
+csv and parquet write one file per sheet like submission_2024.csv.
+Sheets over the row limit of the format are split into 2024, 2024_2, ...
+the Author, Month and Subsystem sheets sum up commits, files, insertions and
+deletions, the subsystem is the top-level directory of the changed file,
+the files in the top-level directory are counted under "/".
+the pygit2 backend walks the commit graph in process instead of spawning git log,
+install cmd is "pip3 install pygit2", git log is used if it is not installed
 
 Description
 	-h --help			display help information
 	-a <author name>	indicate author name
 	-i <input_file>		doc of git log message
-	-o <report_file>	report file of results
+	-o <report_file>	report file of results, .xlsx .xls .csv or .parquet
+	-b <backend>		git (default) or pygit2
+	-j --jobs <N>		scan the history with N git log processes
+	-c <cache_file>		keep the parsed commits in a cache, reruns only parse the new commits
 	-v --version		version information
 """
 
+class CommitRecord(namedtuple("CommitRecord", "commit author date commit_date subject link files insertions deletions statistics release")):
+	"""
+	One parsed commit. files is a tuple of (path, insertions, deletions) and
+	release is 1 for Linus release tag messages, which only go to the Release sheet.
+	"""
+	__slots__ = ()
+
+	@property
+	def sheet_name(self):
+		return self.date[:4]
+
+	@property
+	def changed_file(self):
+		return "\r\n".join(f[0] for f in self.files)
+
+def git_log_cmd(author, since, revision="HEAD"):
+	return ["git", "log", "--since="+since, "--author=torvalds@linux-foundation.org", "--author="+author,
+		"--no-merges", "--numstat", "--format="+LOG_FORMAT, revision]
+
+def git_rev_list_cmd(author, since, revision="HEAD"):
+	return ["git", "rev-list", "--since="+since, "--author=torvalds@linux-foundation.org", "--author="+author,
+		"--no-merges", revision]
+
+def read_git_log(cmd, commit_ids=None):
+	#stream the stdout of git log instead of waiting for a log file
+	if commit_ids is None:
+		proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+	else:
+		#git reads all the revisions from stdin before it starts to write
+		proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+		proc.stdin.write(("\n".join(commit_ids) + "\n").encode())
+		proc.stdin.close()
+	stream = io.TextIOWrapper(proc.stdout, encoding='utf-8', errors='ignore', newline='')
+	try:
+		yield from parse_records(split_records(stream))
+	finally:
+		stream.close()
+		proc.wait()
+	#a failed git log is a truncated history, never hand it on as a complete one
+	if proc.returncode != 0:
+		raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+def scan_commits(commit_ids):
+	#worker of the process pool, --no-walk=unsorted keeps the order of the given commits
+	cmd = ["git", "log", "--no-walk=unsorted", "--stdin", "--numstat", "--format="+LOG_FORMAT]
+	return list(read_git_log(cmd, commit_ids))
+
+def read_git_log_jobs(author, since, jobs, revision="HEAD"):
+	"""
+	Split the commits listed by git rev-list into contiguous ranges, run
+	git log + parse for each range in a process pool and merge the results
+	in the order of the serial run.
+	"""
+	commit_ids = subprocess.check_output(git_rev_list_cmd(author, since, revision), encoding='utf-8').split()
+	#a few ranges per job so a slow range does not keep the others idle
+	size = max(1, -(-len(commit_ids) // (jobs * 4)))
+	with ProcessPoolExecutor(jobs) as pool:
+		futures = [pool.submit(scan_commits, commit_ids[i:i+size]) for i in range(0, len(commit_ids), size)]
+		for future in futures:
+			yield from future.result()
+
+def read_log_file(input_file):
+	with open(input_file, "r", errors='ignore', newline='') as file:
+		first = file.read(1)
+		if first == RECORD_SEP:
+			yield from parse_records(split_records(file))
+		else:
+			yield from parse_commits(itertools.chain([first + file.readline()], file))
+
+def split_records(stream, size=65536):
+	#split the stream on RECORD_SEP chunk by chunk, only the unfinished record is buffered
+	buf = ""
+	while True:
+		chunk = stream.read(size)
+		if not chunk:
+			break
+		pos = chunk.rfind(RECORD_SEP)
+		if pos < 0:
+			buf += chunk
+			continue
+		records = (buf + chunk[:pos]).split(RECORD_SEP)
+		buf = chunk[pos+1:]
+		for record in records:
+			if record:
+				yield record
+	if buf:
+		yield buf
+
+MONTHS = {"Jan": "01", "Feb": "02", "Mar": "03", "Apr": "04", "May": "05", "Jun": "06",
+	"Jul": "07", "Aug": "08", "Sep": "09", "Oct": "10", "Nov": "11", "Dec": "12"}
+
+def format_date(date_str):
+	"""
+	Return the "%Y-%m-%d %H:%M:%S" local time of a git date without strptime.
+	The report keeps the local time of the commit, so the timezone offset
+	never has to be applied and the fields can be sliced out directly.
+	"""
+	if date_str[4:5] == "-":
+		#strict ISO 8601 of %aI/%cI: 2024-11-28T10:00:00+08:00
+		return date_str[:10] + " " + date_str[11:19]
+	#default git date of %ad/%cd: Thu Nov 28 10:00:00 2024 +0800
+	_, month, day, clock, year = date_str.split()[:5]
+	return "%s-%s-%02d %s" % (year, MONTHS[month], int(day), clock)
+
+def format_statistics(nr_files, insertions, deletions):
+	#same summary line as "git log --stat"
+	line = " %d file%s changed" % (nr_files, "" if nr_files == 1 else "s")
+	if insertions or not deletions:
+		line += ", %d insertion%s(+)" % (insertions, "" if insertions == 1 else "s")
+	if deletions or not insertions:
+		line += ", %d deletion%s(-)" % (deletions, "" if deletions == 1 else "s")
+	return line
+
+def make_record(commit_id, author, date, commit_date, subject, body, files, release):
+	#commits without changed files have no statistics line in --stat either
+	if not files:
+		return None
+
+	Link = ""
+	for line in body.splitlines():
+		line = line.strip()
+		if line.startswith("Link: "):
+			Link = line.split()[1]
+
+	insertions = 0
+	deletions = 0
+	for f in files:
+		insertions += f[1]
+		deletions += f[2]
+
+	return CommitRecord(commit_id, author, date, commit_date, subject, Link, tuple(files),
+		insertions, deletions, format_statistics(len(files), insertions, deletions), release)
+
+def parse_records(records):
+	"""
+	Parse the records of LOG_FORMAT + --numstat and yield one CommitRecord per
+	commit. Linus commits are only kept for release tag messages.
+	"""
+	for record in records:
+		fields = record.split(FIELD_SEP)
+		if len(fields) != 7:
+			continue
+		commit_id, author, date_str, commit_date_str, subject, body, numstat = fields
+
+		release = 0
+		if "Linus Torvalds" in author:
+			if "Linux " not in subject:
+				continue
+			release = 1
+
+		files = []
+		for line in numstat.splitlines():
+			if not line:
+				continue
+			added, deleted, path = line.split("\t", 2)
+			#binary files are reported as "-"
+			added = int(added) if added != "-" else 0
+			deleted = int(deleted) if deleted != "-" else 0
+			files.append((path, added, deleted))
+
+		record = make_record(commit_id, author, format_date(date_str), format_date(commit_date_str),
+			subject, body, files, release)
+		if record:
+			yield record
+
+def since_timestamp(since):
+	#let git resolve the approxidate, so both backends cut the history at the same point
+	out = subprocess.check_output(["git", "rev-parse", "--since="+since], encoding='utf-8')
+	return int(out.strip().split("=")[1])
+
+def signature_date(signature):
+	#local time of the signature, the same as shifting the epoch by the offset
+	return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(signature.time + signature.offset * 60))
+
+def rename_path(old_path, new_path):
+	#"dir/{old => new}" like the numstat output of git
+	if old_path == new_path:
+		return new_path
+	pfx = 0
+	while True:
+		pos = old_path.find("/", pfx)
+		if pos < 0 or old_path[:pos+1] != new_path[:pos+1]:
+			break
+		pfx = pos + 1
+	sfx = 0
+	while True:
+		pos = old_path.rfind("/", pfx, len(old_path) - sfx)
+		if pos < 0 or len(new_path) - (len(old_path) - pos) < pfx:
+			break
+		if old_path[pos:] != new_path[len(new_path) - (len(old_path) - pos):]:
+			break
+		sfx = len(old_path) - pos
+	if pfx == 0 and sfx == 0:
+		return old_path + " => " + new_path
+	return "%s{%s => %s}%s" % (old_path[:pfx], old_path[pfx:len(old_path)-sfx],
+		new_path[pfx:len(new_path)-sfx], old_path[len(old_path)-sfx:])
+
+def walk_since(repo, since_time, hide=None):
+	"""
+	Walk the commits like git log --since: newest committer date first, and
+	the parents of a commit older than since are not walked, so both backends
+	stop at the same commits when the committer dates go back and forth.
+	"""
+	allowed = None
+	if hide:
+		walker = repo.walk(repo.head.target, pygit2.GIT_SORT_NONE)
+		walker.hide(hide)
+		allowed = set(commit.id for commit in walker)
+	head = repo[repo.head.target]
+	#the seq keeps the commits of the same date in the order git queues them
+	queue = [(-head.commit_time, 0, head)]
+	seen = {head.id}
+	seq = 1
+	while queue:
+		commit = heapq.heappop(queue)[2]
+		if commit.commit_time < since_time:
+			continue
+		yield commit
+		for parent in commit.parents:
+			if parent.id in seen or (allowed is not None and parent.id not in allowed):
+				continue
+			seen.add(parent.id)
+			heapq.heappush(queue, (-parent.commit_time, seq, parent))
+			seq += 1
+
+def read_pygit2_log(author, since, hide=None, path="."):
+	"""
+	Walk the commit graph with pygit2 and build the same CommitRecord as
+	git log --numstat, the changed files come from the tree diffs.
+	Commits reachable from hide are skipped like hide..HEAD in git.
+	"""
+	repo = pygit2.Repository(pygit2.discover_repository(path))
+	authors = [re.compile("torvalds@linux-foundation.org"), re.compile(author)]
+	for commit in walk_since(repo, since_timestamp(since), hide):
+		if len(commit.parent_ids) > 1:
+			continue
+
+		author_str = "%s <%s>" % (commit.author.name, commit.author.email)
+		if not any(r.search(author_str) for r in authors):
+			continue
+
+		paragraphs = commit.message.split("\n\n", 1)
+		subject = " ".join(paragraphs[0].split("\n")).strip()
+		body = paragraphs[1] if len(paragraphs) > 1 else ""
+		release = 0
+		if "Linus Torvalds" in author_str:
+			if "Linux " not in subject:
+				continue
+			release = 1
+
+		if commit.parents:
+			diff = repo.diff(commit.parents[0], commit)
+		else:
+			diff = commit.tree.diff_to_tree(swap=True)
+		diff.find_similar()
+		files = []
+		for patch in diff:
+			_, added, deleted = patch.line_stats
+			files.append((rename_path(patch.delta.old_file.path, patch.delta.new_file.path), added, deleted))
+
+		record = make_record(str(commit.id), author_str, signature_date(commit.author),
+			signature_date(commit.committer), subject, body, files, release)
+		if record:
+			yield record
+
+def scan_history(author, since, old_head=None):
+	if backend == "pygit2":
+		return read_pygit2_log(author, since, old_head)
+	revision = old_head + "..HEAD" if old_head else "HEAD"
+	if jobs > 1:
+		return read_git_log_jobs(author, since, jobs, revision)
+	return read_git_log(git_log_cmd(author, since, revision))
+
+def read_cached_log(cache_file, author, since):
+	"""
+	Keep the parsed commits in a sqlite cache keyed by commit hash. The last
+	processed HEAD is recorded, so the next run only parses HEAD_old..HEAD
+	and the report is rebuilt from the cache. If the old HEAD is no longer
+	an ancestor of HEAD the history was rewritten and the cache is rebuilt.
+	"""
+	db = sqlite3.connect(cache_file)
+	db.execute("CREATE TABLE IF NOT EXISTS head (query TEXT PRIMARY KEY, commit_id TEXT, batch INTEGER)")
+	db.execute("CREATE TABLE IF NOT EXISTS commits (query TEXT, commit_id TEXT, batch INTEGER, seq INTEGER, "
+		"data TEXT, PRIMARY KEY (query, commit_id))")
+	query = author + "\n" + since
+	head = subprocess.check_output(["git", "rev-parse", "HEAD"], encoding='utf-8').strip()
+
+	row = db.execute("SELECT commit_id, batch FROM head WHERE query = ?", (query,)).fetchone()
+	old_head, batch = row if row else (None, 0)
+	if old_head and subprocess.run(["git", "merge-base", "--is-ancestor", old_head, head]).returncode != 0:
+		print("History is rewritten, rebuild the cache")
+		old_head = None
+	if not old_head:
+		db.execute("DELETE FROM commits WHERE query = ?", (query,))
+		batch = 0
+
+	if old_head != head:
+		#new commits are newer than all the cached ones, so each run is a new batch on the top
+		batch += 1
+		seq = 0
+		try:
+			for record in scan_history(author, since, old_head):
+				db.execute("INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?, ?)",
+					(query, record.commit, batch, seq, json.dumps(record)))
+				seq += 1
+		except Exception:
+			#head is only recorded after a clean scan, the next run scans the same range again
+			db.rollback()
+			db.close()
+			raise
+		db.execute("INSERT OR REPLACE INTO head VALUES (?, ?, ?)", (query, head, batch))
+		db.commit()
+	print("Cached commits:", db.execute("SELECT COUNT(*) FROM commits WHERE query = ?", (query,)).fetchone()[0])
+
+	try:
+		for (data,) in db.execute("SELECT data FROM commits WHERE query = ? ORDER BY batch DESC, seq", (query,)):
+			fields = json.loads(data)
+			fields[6] = tuple(tuple(f) for f in fields[6])
+			yield CommitRecord(*fields)
+	finally:
+		db.close()
+
+stat_file_re = re.compile(r"^ (.*\S)\s+\|\s+(?:(\d+) ?(\+*)(-*)|Bin.*)$")
+stat_insert_re = re.compile(r"(\d+) insertions?\(\+\)")
+stat_delete_re = re.compile(r"(\d+) deletions?\(-\)")
+
+def parse_stat_file(line):
+	#" path | 12 ++++----", the graph is only scaled for big changes
+	match = stat_file_re.match(line.rstrip("\r\n"))
+	if match is None:
+		return (line.split()[0], 0, 0)
+	path, count, plus, minus = match.groups()
+	if not count or not (plus or minus):
+		return (path, 0, 0)
+	added = round(int(count) * len(plus) / (len(plus) + len(minus)))
+	return (path, added, int(count) - added)
+
+def parse_commits(lines):
+	"""
+	Parse the old "git log --stat" text and yield one CommitRecord per commit
+	as soon as its statistics line arrives.
+	"""
+	author_flag = 0
+	release_tag_msg = 0
+	changed_file = []
+	Link = ""
+	for line in lines:
+		if 'commit ' in line:
+			commit_id = line.split()[1]
+
+		if 'Author: ' in line:
+			author = line.split()[1:]
+			author = " ".join(author)
+			if "Linus Torvalds" in author:
+				author_flag = 1
+
+		if 'Date: ' in line:
+			date_str = line.split()[1:]
+			date = format_date(" ".join(date_str))
+
+		if 'commit_date: ' in line:
+			date_str = line.split()[1:]
+			commit_date = format_date(" ".join(date_str))
+
+		if 'Subject: ' in line:
+			subject = line.split()[1:]
+			subject = " ".join(subject)
+			if "Linux " in subject:
+				release_tag_msg = 1
+
+		if 'Link: ' in line:
+			Link = line.split()[1]
+
+		if ' | ' in line:
+			changed_file.append(parse_stat_file(line))
+
+		if 'file changed,' in line or 'files changed,' in line:
+			#only record linus for release tag message
+			if author_flag == 0 or release_tag_msg == 1:
+				match = stat_insert_re.search(line)
+				insertions = int(match.group(1)) if match else 0
+				match = stat_delete_re.search(line)
+				deletions = int(match.group(1)) if match else 0
+				yield CommitRecord(commit_id, author, date, commit_date, subject, Link,
+					tuple(changed_file), insertions, deletions, line.rstrip('\r\n'), author_flag)
+
+			changed_file = []
+			Link = ""
+			author_flag = 0
+			release_tag_msg = 0
+
+class XlsReport:
+	#xlwt keeps the whole workbook in memory anyway, the rows are kept until close()
+	max_rows = 65536
+
+	def __init__(self, report_file):
+		self.report_file = report_file
+		self.sheets = {}
+
+	def add_sheet(self, sheet_name, col):
+		self.sheets[sheet_name] = [col]
+
+	def write_row(self, sheet_name, values):
+		self.sheets[sheet_name].append(values)
+
+	def close(self, sheet_names):
+		book = xlwt.Workbook(encoding='utf-8', style_compression=0)
+		for sheet_name in sheet_names:
+			sheet = book.add_sheet(sheet_name)
+			for row, values in enumerate(self.sheets[sheet_name]):
+				for i in range(0,len(values)):
+					sheet.write(row, i, values[i])
+		book.save(self.report_file)
+
+class XlsxReport:
+	#write-only workbook of openpyxl, the rows are streamed to temp files
+	max_rows = 1048576
+
+	def __init__(self, report_file):
+		self.report_file = report_file
+		self.book = openpyxl.Workbook(write_only=True)
+		self.sheets = {}
+
+	def add_sheet(self, sheet_name, col):
+		self.sheets[sheet_name] = self.book.create_sheet(sheet_name)
+		self.sheets[sheet_name].append(col)
+
+	def write_row(self, sheet_name, values):
+		values = [ILLEGAL_CHARACTERS_RE.sub("", v) if isinstance(v, str) else v for v in values]
+		self.sheets[sheet_name].append(values)
+
+	def close(self, sheet_names):
+		for index, sheet_name in enumerate(sheet_names):
+			sheet = self.sheets[sheet_name]
+			self.book.move_sheet(sheet_name, index - self.book.index(sheet))
+		self.book.save(self.report_file)
+
+class CsvReport:
+	#one csv file per sheet, named <report>_<sheet>.csv
+	max_rows = None
+
+	def __init__(self, report_file):
+		self.root = os.path.splitext(report_file)[0]
+		self.files = {}
+		self.writers = {}
+
+	def add_sheet(self, sheet_name, col):
+		self.files[sheet_name] = open(self.root + "_" + sheet_name + ".csv", "w", encoding='utf-8', newline='')
+		self.writers[sheet_name] = csv.writer(self.files[sheet_name])
+		self.writers[sheet_name].writerow(col)
+
+	def write_row(self, sheet_name, values):
+		self.writers[sheet_name].writerow(values)
+
+	def close(self, sheet_names):
+		for file in self.files.values():
+			file.close()
+
+class ParquetReport:
+	#one parquet file per sheet, named <report>_<sheet>.parquet and written in row groups
+	max_rows = None
+	batch_rows = 10000
+
+	def __init__(self, report_file):
+		self.root = os.path.splitext(report_file)[0]
+		self.cols = {}
+		self.rows = {}
+		self.schemas = {}
+		self.writers = {}
+
+	def add_sheet(self, sheet_name, col):
+		self.cols[sheet_name] = col
+		self.rows[sheet_name] = []
+
+	def write_row(self, sheet_name, values):
+		self.rows[sheet_name].append(values)
+		if len(self.rows[sheet_name]) >= self.batch_rows:
+			self.flush(sheet_name)
+
+	def flush(self, sheet_name):
+		rows = self.rows[sheet_name]
+		if not rows and sheet_name in self.writers:
+			return
+		col = self.cols[sheet_name]
+		if sheet_name not in self.writers:
+			#the types of the columns come from the first row
+			types = [pyarrow.int64() if rows and isinstance(v, int) else pyarrow.string() for v in (rows[0] if rows else col)]
+			self.schemas[sheet_name] = pyarrow.schema(list(zip(col, types)))
+			self.writers[sheet_name] = pyarrow.parquet.ParquetWriter(self.root + "_" + sheet_name + ".parquet", self.schemas[sheet_name])
+		schema = self.schemas[sheet_name]
+		columns = list(zip(*rows)) if rows else [[] for _ in col]
+		arrays = [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)]
+		self.writers[sheet_name].write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+		self.rows[sheet_name] = []
+
+	def close(self, sheet_names):
+		for sheet_name in sheet_names:
+			self.flush(sheet_name)
+			self.writers[sheet_name].close()
+
+def open_report(report_file):
+	ext = os.path.splitext(report_file)[1].lower()
+	if ext == ".xlsx" and openpyxl is None:
+		print("openpyxl is not installed, write the xlsx file with xlwt")
+		ext = ".xls"
+	if ext == ".csv":
+		return CsvReport(report_file)
+	if ext == ".parquet":
+		if pyarrow is None:
+			print("Pls install pyarrow for parquet output: pip3 install pyarrow")
+			sys.exit(2)
+		return ParquetReport(report_file)
+	if ext == ".xlsx":
+		return XlsxReport(report_file)
+	if xlwt is None:
+		print("Pls install xlwt for xls output: pip3 install xlwt")
+		sys.exit(2)
+	return XlsReport(report_file)
+
+class SheetSplitter:
+	"""
+	Write the rows of one logical sheet, a new sheet "<name>_2", "<name>_3"...
+	is started when the row limit of the report format is reached.
+	"""
+	def __init__(self, report, sheet_name, col, sheet_names):
+		self.report = report
+		self.sheet_name = sheet_name
+		self.col = col
+		self.sheet_names = sheet_names
+		self.part = 0
+		self.row = 0
+		self.count = 0
+
+	def write_row(self, values):
+		if self.part == 0 or (self.report.max_rows and self.row >= self.report.max_rows):
+			self.part += 1
+			self.current = self.sheet_name if self.part == 1 else "%s_%d" % (self.sheet_name, self.part)
+			self.report.add_sheet(self.current, self.col)
+			self.sheet_names.append(self.current)
+			self.row = 1
+		self.report.write_row(self.current, values)
+		self.row += 1
+		self.count += 1
+
+rename_re = re.compile(r"\{[^{}]* => ([^{}]*)\}")
+
+def subsystem_of(path):
+	#top-level directory of the new path, "dir/{a => b}/x.c" and "a => b" are renames
+	if " => " in path:
+		path = rename_re.sub(r"\1", path)
+		path = path.split(" => ")[-1].replace("//", "/")
+	#files in the top-level directory like Makefile and MAINTAINERS are one subsystem
+	if "/" not in path:
+		return "/"
+	return path.split("/", 1)[0]
+
+class CommitStats:
+	"""
+	Columnar statistics of the commits, one array per column is appended
+	during the parse. group_by() builds the per author, per month and per
+	subsystem totals of commits, files, insertions and deletions in one pass
+	over the columns.
+	"""
+	def __init__(self):
+		self.keys = {"Author": {}, "Month": {}, "Subsystem": {}}
+		self.author = array("l")
+		self.month = array("l")
+		self.files = array("l")
+		self.insertions = array("q")
+		self.deletions = array("q")
+		#one row per changed file
+		self.file_commit = array("l")
+		self.file_subsystem = array("l")
+		self.file_insertions = array("q")
+		self.file_deletions = array("q")
+
+	def code(self, group, key):
+		keys = self.keys[group]
+		if key not in keys:
+			keys[key] = len(keys)
+		return keys[key]
+
+	def add(self, record):
+		commit = len(self.author)
+		self.author.append(self.code("Author", record.author))
+		self.month.append(self.code("Month", record.date[:7]))
+		self.files.append(len(record.files))
+		self.insertions.append(record.insertions)
+		self.deletions.append(record.deletions)
+		for path, added, deleted in record.files:
+			self.file_commit.append(commit)
+			self.file_subsystem.append(self.code("Subsystem", subsystem_of(path)))
+			self.file_insertions.append(added)
+			self.file_deletions.append(deleted)
+
+	def group_by(self):
+		#[commits, files, insertions, deletions] per code of each group
+		totals = {group: [[0, 0, 0, 0] for _ in keys] for group, keys in self.keys.items()}
+		for group, codes in (("Author", self.author), ("Month", self.month)):
+			sums = totals[group]
+			for commit, code in enumerate(codes):
+				total = sums[code]
+				total[0] += 1
+				total[1] += self.files[commit]
+				total[2] += self.insertions[commit]
+				total[3] += self.deletions[commit]
+
+		sums = totals["Subsystem"]
+		last_commit = [-1] * len(sums)
+		for i, code in enumerate(self.file_subsystem):
+			total = sums[code]
+			#file rows are in commit order, count each commit once per subsystem
+			if last_commit[code] != self.file_commit[i]:
+				last_commit[code] = self.file_commit[i]
+				total[0] += 1
+			total[1] += 1
+			total[2] += self.file_insertions[i]
+			total[3] += self.file_deletions[i]
+
+		results = {}
+		for group, keys in self.keys.items():
+			rows = [[key] + totals[group][code] for key, code in keys.items()]
+			if group == "Month":
+				rows.sort(key=lambda row: row[0])
+			else:
+				rows.sort(key=lambda row: (-row[1], row[0]))
+			results[group] = rows
+		return results
+
+def commit_row(row, record):
+	return [row, record.commit, record.author, record.date, record.commit_date, record.subject,
+		record.link, record.changed_file, record.statistics]
+
+def write_report(commits, report_file):
+	report = open_report(report_file)
+	col = ['id', 'commit', 'Author', 'Date', 'CommitDate', 'Subject', 'Link', 'Changed File', 'Statistics']
+	year_sheets = {}
+	year_names = []
+	release_names = []
+	release = SheetSplitter(report, "Release", col, release_names)
+	stats = CommitStats()
+
+	for record in commits:
+		#every commit goes to the Release sheet
+		release.write_row(commit_row(release.count + 1, record))
+		if record.release:
+			continue
+
+		#create the sheet if not exist
+		sheet_name = record.sheet_name
+		if sheet_name not in year_sheets:
+			year_sheets[sheet_name] = SheetSplitter(report, sheet_name, col, year_names)
+		sheet = year_sheets[sheet_name]
+		sheet.write_row(commit_row(sheet.count + 1, record))
+		stats.add(record)
+
+	if not release_names:
+		report.add_sheet("Release", col)
+		release_names.append("Release")
+
+	#add Summary sheet
+	report.add_sheet("Summary", ["Year", "Nr of Commit"])
+	for sheet_name, sheet in year_sheets.items():
+		report.write_row("Summary", [sheet_name, sheet.count])
+
+	#add Author/Month/Subsystem sheets
+	stat_names = []
+	for group, rows in stats.group_by().items():
+		sheet = SheetSplitter(report, group, [group, "Nr of Commit", "Nr of File", "Insertions", "Deletions"], stat_names)
+		for row in rows:
+			sheet.write_row(row)
+
+	#year sheets, Summary, the Linus release message tag information and the statistics
+	report.close(year_names + ["Summary"] + release_names + stat_names)
+
 if __name__ == '__main__':
 	try:
-		opts, args = getopt.getopt(sys.argv[1:], "a:i:o:hv", ["help","version"])
+		opts, args = getopt.getopt(sys.argv[1:], "a:i:o:b:j:c:hv", ["help","version","jobs="])
 	except getopt.GetoptError as err:
 		print(err)
 		print(usage.__doc__)
@@ -49,6 +784,12 @@ if __name__ == '__main__':
 			input_file = arg
 		elif opt in ("-o"):
 			report_file = arg
+		elif opt in ("-b"):
+			backend = arg
+		elif opt in ("-j", "--jobs"):
+			jobs = int(arg)
+		elif opt in ("-c"):
+			cache_file = arg
 		elif opt in ("-v", "--version"):
 			print(VERSION)
 			sys.exit()
@@ -56,154 +797,26 @@ if __name__ == '__main__':
 			print("Using the wrong way, please refer the help information!")
 			assert False, "unhandled option"
 
-	
 	if input_file == "":
 		if author == "":
 			print(usage.__doc__)
 			sys.exit()
+		if backend == "pygit2" and pygit2 is None:
+			print("pygit2 is not installed, fall back to git log")
+			backend = "git"
+		if cache_file:
+			commits = read_cached_log(cache_file, author, since)
+		else:
+			commits = scan_history(author, since)
+	elif os.path.exists(input_file):
+		commits = read_log_file(input_file)
+	else:
+		print("Can not find the input file: "+input_file)
+		sys.exit(2)
 
-		os.system("git log --since=2017 --author=torvalds@linux-foundation.org --author="+author+" --no-merges --stat --format=\"%ncommit %H%nAuthor: %an <%ae>%nDate: %ad%ncommit_date: %cd%nSubject: %s%n%n%b\" --output=log.txt")
-		input_file = "log.txt"
-
-	book = xlwt.Workbook(encoding='utf-8', style_compression=0)
-	author_flag = 0
-	release_tag_msg = 0
-	commit_list = []
-	total_list = []
-
-	if os.path.exists(input_file):
-		file = open(input_file, "r", errors='ignore', newline='')
-		lines = file.readlines()
-		changed_file = ""
-		Link = ""
-		sheet_names = []
-		for line in lines:
-			if 'commit ' in line:
-				commit_id = line.split()[1]
-
-			if 'Author: ' in line:
-				author = line.split()[1:]
-				author = " ".join(author)
-				if "Linus Torvalds" in author:
-					author_flag = 1
-
-			if 'Date: ' in line:
-				date_str = line.split()[1:]
-				date_str = " ".join(date_str)
-				datetime_obj = datetime.strptime(date_str, "%a %b %d %H:%M:%S %Y %z")
-				date = datetime_obj.strftime("%Y-%m-%d %H:%M:%S")
-				sheet_name = datetime_obj.strftime("%Y")
-
-			if 'commit_date: ' in line:
-				date_str = line.split()[1:]
-				date_str = " ".join(date_str)
-				datetime_obj = datetime.strptime(date_str, "%a %b %d %H:%M:%S %Y %z")
-				commit_date = datetime_obj.strftime("%Y-%m-%d %H:%M:%S")
-
-			if 'Subject: ' in line:
-				subject = line.split()[1:]
-				subject = " ".join(subject)
-				if "Linux " in subject:
-					release_tag_msg = 1
-
-			if 'Link: ' in line:
-				Link = line.split()[1]
-
-			if ' | ' in line:
-				changed_file += line.split()[0]+'\r\n'
-
-			if 'file changed,' in line or 'files changed,' in line:
-				#only record linus for release tag message
-				if author_flag == 1:
-					if release_tag_msg == 1:
-						commit_list.append(commit_id)
-						commit_list.append(author)
-						commit_list.append(date)
-						commit_list.append(commit_date)
-						commit_list.append(subject)
-						commit_list.append(Link)
-						commit_list.append(changed_file)
-						commit_list.append(line)
-						total_list.append(commit_list)
-						commit_list = []
-
-					changed_file = ""
-					Link = ""
-					author_flag = 0
-					release_tag_msg = 0
-					continue
-
-				#create the sheet if not exist
-				try:
-					sheet = book.get_sheet(sheet_name)
-					row = sheet.last_used_row + 1
-				except:
-					sheet_names.append(sheet_name)
-					sheet = book.add_sheet(sheet_name)
-					col = ['id', 'commit', 'Author', 'Date', 'CommitDate', 'Subject', 'Link', 'Changed File', 'Statistics']
-					for i in range(0,len(col)):
-						#write the first row
-						sheet.write(0, i, col[i])
-						row = 1
-
-				sheet.write(row, 0, row)#write the id
-				sheet.write(row, 1, commit_id)#write the commit_id
-				sheet.write(row, 2, author)#write the author
-				sheet.write(row, 3, date)#write the Date
-				sheet.write(row, 4, commit_date)#write the Commit Date
-				sheet.write(row, 5, subject)#write the subject
-				sheet.write(row, 6, Link)#write the Link
-				sheet.write(row, 7, changed_file.rstrip('\r\n'))#write the changed file list
-				sheet.write(row, 8, line.rstrip('\r\n'))#write the statistics of this commit
-
-				#record the commit to total_list
-				commit_list.append(commit_id)
-				commit_list.append(author)
-				commit_list.append(date)
-				commit_list.append(commit_date)
-				commit_list.append(subject)
-				commit_list.append(Link)
-				commit_list.append(changed_file)
-				commit_list.append(line)
-				total_list.append(commit_list)
-
-				commit_list = []
-				changed_file = ""
-				Link = ""
-				author_flag = 0
-				release_tag_msg = 0
-				row += 1
-
-#add Summary sheet
-sum_sheet = book.add_sheet("Summary")
-sum_sheet.write(0, 0, "Year")
-sum_sheet.write(0, 1, "Nr of Commit")
-row = 1
-for sheet_name in sheet_names:
-	sum_sheet.write(row, 0, sheet_name)
-	sheet = book.get_sheet(sheet_name)
-	sum_sheet.write(row, 1, sheet.last_used_row)
-	row += 1
-
-#add Linus release message tag information
-rls_sheet = book.add_sheet("Release")
-col = ['id', 'commit', 'Author', 'Date', 'CommitDate', 'Subject', 'Link', 'Changed File', 'Statistics']
-for i in range(0,len(col)):
-	#write the first row
-	rls_sheet.write(0, i, col[i])
-	row = 1
-
-for commit_list in total_list:
-	rls_sheet.write(row, 0, row)#write the id
-	rls_sheet.write(row, 1, commit_list[0])#write the commit_id
-	rls_sheet.write(row, 2, commit_list[1])#write the author
-	rls_sheet.write(row, 3, commit_list[2])#write the Date
-	rls_sheet.write(row, 4, commit_list[3])#write the Commit Date
-	rls_sheet.write(row, 5, commit_list[4])#write the subject
-	rls_sheet.write(row, 6, commit_list[5])#write the Link
-	rls_sheet.write(row, 7, commit_list[6].rstrip('\r\n'))#write the changed file list
-	rls_sheet.write(row, 8, commit_list[7].rstrip('\r\n'))#write the statistics of this commit
-	row += 1
-
-book.save(report_file)
-print("OK! Pls Check Report File: "+report_file)
+	try:
+		write_report(commits, report_file)
+	except subprocess.CalledProcessError as err:
+		print("git log failed with return code", err.returncode)
+		sys.exit(2)
+	print("OK! Pls Check Report File: "+report_file)
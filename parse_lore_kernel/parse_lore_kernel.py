@@ -2,17 +2,68 @@
 # -*- coding: UTF-8 -*-
 
 import os
+import re
 import sys
 import getopt
 import requests
 import xlwt
+import zlib
+import json
+import time
+import random
+import codecs
+import sqlite3
 import calendar
-from datetime import datetime
+import threading
+import email.parser
+import email.policy
+import email.utils
+from html.parser import HTMLParser
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import quote, unquote
 
 VERSION="v2025.3.7"
 
 url_path="https://lore.kernel.org/all/?q="
 report_file="result.xls"
+jobs = 4
+split_period = ""
+backend = "html"
+#responses fetched after their window closed never change, the others are revalidated after CACHE_TTL
+CACHE_FILE = os.path.expanduser("~/.cache/parse_lore_kernel.db")
+CACHE_MAX_SIZE = 256 * 1024 * 1024
+CACHE_TTL = 3600
+response_cache = None
+#lore days and d: ranges are UTC, a day is closed this long after its UTC midnight,
+#later mails of the day may still be on their way
+CLOSED_GRACE = 6 * 3600
+#parsed pages of an unfinished run, rerun the same command to resume from the failed page
+CHECKPOINT_FILE = os.path.expanduser("~/.cache/parse_lore_kernel.checkpoint.db")
+#later the pages of the open windows are stale, the run starts over
+CHECKPOINT_MAX_AGE = 24 * 3600
+checkpoint = None
+#lore throttles heavy clients, failed requests are retried with exponential backoff and jitter
+RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+RETRY_STATUS = (429, 500, 502, 503, 504)
+THROTTLE_STATUS = (429, 503)
+rate_limiter = None
+mail_domains = []
+store_file = ""
+#be polite to lore.kernel.org, never more requests in flight than this
+MAX_JOBS = 8
+PAGE_SIZE = 200 #each request for 200 items
+
+HEADERS = {
+	'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+	'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+	'Accept-Language': 'en-US,en;q=0.5',
+	'Referer': 'https://lore.kernel.org/',
+	'Connection': 'keep-alive',
+}
 
 def usage():
 	"""
@@ -21,15 +72,26 @@ Usage: ./parse_lore_kernel.py -f <Mail domain> -y 2023
 default output file is result.txt
 
 Example: ./parse_lore_kernel.py -f gmail.com -y 2023
+         ./parse_lore_kernel.py -f amlogic.com,gmail.com -y 2023
 Note: This script is depend on requests and xlwt library, install cmd is "pip3 install requests xlwt"
 
 Description
 	-h --help			display help information
-	-f <Mail domain>	match within the From header
+	-f <Mail domain>	match within the From header, a comma separated list or @file
+						with one domain/address per line gives one workbook with the
+						sheets of every domain and a Summary across the domains
 	-y <year>			assign the year
 	-s <start_date>		format like 2023-01-01
 	-e <end_date>		format like 2023-06-30
 	-m <target_month>	assign the year-month, like 2023-07
+	-j <jobs>			pages fetched concurrently, default 4, at most 8
+	-p <period>			split the date range into month or week sub-queries fetched concurrently
+	-b <backend>		html (default) scrapes the result pages 200 items at a time,
+						mbox downloads the whole result as one mbox.gz and reads the
+						headers, replies are then matched by In-Reply-To/References
+	--no-cache			do not use the response cache in ~/.cache/parse_lore_kernel.db
+	-d <store_file>		keep the messages in a local sqlite store, only the days not
+						synced yet are fetched and the report is made from the store
 	-v --version		version information
 """
 def get_last_day_of_month(date_str):
@@ -50,15 +112,20 @@ def get_last_day_of_month(date_str):
 def is_date_between(start_date, end_date, target_date):
     return start_date <= target_date <= end_date
 
-def extract_substring(main_string, start_marker, end_marker):
-	start_index = main_string.find(start_marker)
-	end_index = main_string.find(end_marker, start_index + len(start_marker))
+def closed_at(day):
+	#timestamp from which no more mails arrive for the UTC day, its results never change again
+	return datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() + 24 * 3600 + CLOSED_GRACE
 
-	if start_index != -1 and end_index != -1:
-		extracted_substring = main_string[start_index + len(start_marker):end_index]
-		return extracted_substring
-	else:
-		return None
+def is_closed(day):
+	return time.time() >= closed_at(day)
+
+def write_summary(book, rows):
+	sheet = book.add_sheet("Summary")
+	for col, title in enumerate(("Domain", "Total", "Submission", "Reply", "Review")):
+		sheet.write(0, col, title)
+	for row, counts in enumerate(rows, 1):
+		for col, value in enumerate(counts):
+			sheet.write(row, col, value)
 
 def write_sheet(book, sheet_name, list_name):
 	sheet = book.add_sheet(sheet_name)
@@ -77,37 +144,613 @@ def write_sheet(book, sheet_name, list_name):
 		row += 1
 #		print("subject:", info[0])
 
+#msgid and refs (In-Reply-To + References) are only known from the mbox backend
+Message = namedtuple("Message", "subject link author date msgid refs", defaults=(None, ()))
+
+class ResultPageParser(HTMLParser):
+	"""
+	Single pass parser of a lore search result page. Every result is an
+	<a href="msgid/">subject</a> followed by " - by author @ date UTC [..%]",
+	the finished messages are collected in self.messages.
+	"""
+	#public-inbox pads the hour with a space, " 9:17"
+	by_re = re.compile(r"^\s*-\s*by (.*?) @ (\d{4}-\d\d-\d\d)\s+(\d{1,2}):(\d\d) UTC \[")
+
+	def __init__(self):
+		super().__init__(convert_charrefs=True)
+		self.messages = []
+		self.href = None
+		self.text = None
+		self.anchor = None
+		#text between two tags may arrive in several pieces
+		self.data = []
+
+	def handle_starttag(self, tag, attrs):
+		self.flush_data()
+		if tag == "a":
+			self.href = dict(attrs).get("href")
+			self.text = []
+
+	def handle_endtag(self, tag):
+		self.flush_data()
+		if tag == "a" and self.text is not None:
+			self.anchor = (self.href, "".join(self.text))
+			self.text = None
+
+	def handle_data(self, data):
+		self.data.append(data)
+
+	def close(self):
+		super().close()
+		self.flush_data()
+
+	def flush_data(self):
+		if not self.data:
+			return
+		data = "".join(self.data)
+		self.data = []
+		if self.text is not None:
+			self.text.append(data)
+			return
+		if self.anchor is None:
+			return
+		match = self.by_re.match(data)
+		if match:
+			href, title = self.anchor
+			if href and "[PATCH" in title:
+				link = "https://lore.kernel.org/all/" + href.rstrip("/")
+				day, hour, minute = match.group(2, 3, 4)
+				self.messages.append(Message(title, link, match.group(1), "%s %02d:%s UTC" % (day, int(hour), minute),
+					unquote(href.rstrip("/"))))
+			self.anchor = None
+		elif data.strip():
+			self.anchor = None
+
+def parse_result_page(chunks):
+	#feed the page chunk by chunk and yield the messages as soon as they are parsed
+	parser = ResultPageParser()
+	if isinstance(chunks, str):
+		chunks = [chunks]
+	for chunk in chunks:
+		parser.feed(chunk)
+		yield from parser.messages
+		parser.messages = []
+	parser.close()
+	yield from parser.messages
+
 def get_title(http_resp, start_date, end_date):
-	lines = http_resp.split("\n")
-	title_list = []
 	total_list = []
-	line_index = 0
 	continue_flag = 0
-	for line in lines:
-		if "[PATCH" in line:
-			title = extract_substring(line, "\">", "</a>")
-			link = "https://lore.kernel.org/all/" + extract_substring(line, "href=\"", "/\">")
-			line_index=lines.index(line)
-			author = extract_substring(lines[line_index+1], "by ", " @")
-			date = extract_substring(lines[line_index+1], "@ ", " [")
-			this_date = datetime.strptime(date, "%Y-%m-%d %H:%M %Z").date()
-			if is_date_between(start_date, end_date, this_date):
-				title_list.append(title)
-				title_list.append(link)
-				title_list.append(author)
-				title_list.append(date)
-				total_list.append(title_list)
-				title_list = []
-				continue_flag = 1
-			else:
-				continue_flag = 0
+	for message in parse_result_page(http_resp):
+		this_date = date.fromisoformat(message.date[:10])
+		if is_date_between(start_date, end_date, this_date):
+			total_list.append(message)
+			continue_flag = 1
+		else:
+			continue_flag = 0
 
 	return total_list, continue_flag
 
+#"Re: ", "Fwd: " and "[PATCH v2 1/3]" like tags in front of the subject
+subject_prefix_re = re.compile(r"^\s*(?:(?:re|fwd?|aw)\s*:\s*|\[[^\]]*\]\s*)+", re.IGNORECASE)
+
+def normalize_subject(subject):
+	return " ".join(subject_prefix_re.sub("", subject).split()).lower()
+
+def classify_messages(total_list):
+	"""
+	Dedupe the messages by subject and split them into submissions, replies
+	and reviews. A reply is a review when its normalized subject matches no
+	submission, the subjects are kept in sets so every step is linear.
+	"""
+	titles = set()
+	new_total_list = []
+	for info in total_list:
+		if info[0] not in titles:
+			titles.add(info[0])
+			new_total_list.append(info)
+
+	submission_list = []
+	replay_list = []
+	for info in new_total_list:
+		if "Re: " in info[0]:
+			replay_list.append(info)
+		else:
+			submission_list.append(info)
+
+	submission_keys = set(normalize_subject(info[0]) for info in submission_list)
+	submission_ids = set(info.msgid for info in submission_list if info.msgid)
+	#replay is not in submission list, by the thread references or by the subject
+	review_list = [info for info in replay_list
+		if not submission_ids.intersection(info.refs) and normalize_subject(info[0]) not in submission_keys]
+
+	return new_total_list, submission_list, replay_list, review_list
+
+class FetchError(Exception):
+	pass
+
+class RetryableError(FetchError):
+	def __init__(self, message, retry_after=0):
+		super().__init__(message)
+		self.retry_after = retry_after
+
+def parse_retry_after(value):
+	#Retry-After is either seconds or an http date
+	if not value:
+		return 0
+	try:
+		return max(float(value), 0)
+	except ValueError:
+		pass
+	try:
+		return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+	except (TypeError, ValueError, IndexError):
+		return 0
+
+def retry_call(func, *args):
+	"""
+	Call func until it returns, retrying the connection errors and the
+	RETRY_STATUS responses with full jitter exponential backoff, never
+	sooner than the Retry-After of the server.
+	"""
+	for attempt in range(RETRIES + 1):
+		try:
+			return func(*args)
+		except (RetryableError, requests.ConnectionError, requests.Timeout,
+				requests.exceptions.ChunkedEncodingError) as err:
+			if attempt == RETRIES:
+				raise FetchError("giving up after " + str(RETRIES) + " retries: " + str(err))
+			delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+			delay = max(delay, getattr(err, "retry_after", 0))
+			print("retry in %.1fs: %s" % (delay, err))
+			time.sleep(delay)
+
+class RateLimiter:
+	"""
+	Adaptive cap of the requests in flight: halved on every 429/503 and the
+	Retry-After pauses all the threads, raised by one again after as many
+	successful requests as the current cap, up to max_limit.
+	"""
+	def __init__(self, max_limit):
+		self.max_limit = max_limit
+		self.limit = max_limit
+		self.inflight = 0
+		self.successes = 0
+		self.resume_at = 0
+		self.cond = threading.Condition()
+
+	def acquire(self):
+		with self.cond:
+			while True:
+				wait = self.resume_at - time.time()
+				if wait > 0:
+					self.cond.wait(wait)
+				elif self.inflight >= self.limit:
+					self.cond.wait()
+				else:
+					break
+			self.inflight += 1
+
+	def release(self, throttled=False, retry_after=0):
+		with self.cond:
+			self.inflight -= 1
+			if throttled:
+				self.limit = max(1, self.limit // 2)
+				self.successes = 0
+				self.resume_at = max(self.resume_at, time.time() + retry_after)
+			else:
+				self.successes += 1
+				if self.successes >= self.limit and self.limit < self.max_limit:
+					self.limit += 1
+					self.successes = 0
+			self.cond.notify_all()
+
+class PageCheckpoint:
+	"""
+	Parsed result pages of one command keyed by request url, kept until the
+	command finishes so a failed run resumes at the failing offset. New mails
+	shift the offsets of the open windows, the pages fetched again then repeat
+	some results and the title/link dedupe drops them. Pages older than
+	CHECKPOINT_MAX_AGE are not used.
+	"""
+	def __init__(self, checkpoint_file, run):
+		os.makedirs(os.path.dirname(checkpoint_file) or ".", exist_ok=True)
+		self.db = sqlite3.connect(checkpoint_file, check_same_thread=False)
+		self.db.execute("CREATE TABLE IF NOT EXISTS pages (run TEXT, url TEXT, messages TEXT, flag INTEGER, saved REAL, "
+			"PRIMARY KEY (run, url))")
+		self.db.execute("DELETE FROM pages WHERE saved < ?", (time.time() - CHECKPOINT_MAX_AGE,))
+		self.db.commit()
+		self.run = run
+		self.lock = threading.Lock()
+
+	def get(self, url):
+		with self.lock:
+			row = self.db.execute("SELECT messages, flag FROM pages WHERE run = ? AND url = ? AND saved >= ?",
+				(self.run, url, time.time() - CHECKPOINT_MAX_AGE)).fetchone()
+		if row is None:
+			return None
+		#json gives the refs back as a list
+		return [Message(*info[:4], info[4], tuple(info[5])) for info in json.loads(row[0])], row[1]
+
+	def put(self, url, messages, flag):
+		with self.lock:
+			self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+				(self.run, url, json.dumps(messages), int(flag), time.time()))
+			self.db.commit()
+
+	def clear(self):
+		#only the pages of this command, other commands may still resume
+		with self.lock:
+			self.db.execute("DELETE FROM pages WHERE run = ?", (self.run,))
+			self.db.commit()
+
+def new_session(pool_size):
+	#one keep-alive connection pool shared by all the fetch threads
+	session = requests.Session()
+	adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+	session.mount("https://", adapter)
+	session.mount("http://", adapter)
+	session.headers.update(HEADERS)
+	return session
+
+class ResponseCache:
+	"""
+	Persistent cache of the response bodies keyed by method and full query
+	url, the bodies are stored zlib compressed with their ETag/Last-Modified.
+	The least recently used responses are evicted above max_size bytes.
+	"""
+	def __init__(self, cache_file, max_size=CACHE_MAX_SIZE):
+		os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+		self.db = sqlite3.connect(cache_file, check_same_thread=False)
+		self.db.execute("CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, body BLOB, etag TEXT, "
+			"last_modified TEXT, fetched REAL, accessed REAL, size INTEGER)")
+		self.max_size = max_size
+		self.lock = threading.Lock()
+
+	def get(self, url):
+		with self.lock:
+			row = self.db.execute("SELECT body, etag, last_modified, fetched FROM responses WHERE url = ?", (url,)).fetchone()
+			if row is None:
+				return None
+			self.db.execute("UPDATE responses SET accessed = ? WHERE url = ?", (time.time(), url))
+			self.db.commit()
+		return zlib.decompress(row[0]), row[1], row[2], row[3]
+
+	def put(self, url, body, etag, last_modified):
+		data = zlib.compress(body)
+		now = time.time()
+		with self.lock:
+			self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+				(url, data, etag, last_modified, now, now, len(data)))
+			self.evict()
+			self.db.commit()
+
+	def touch(self, url):
+		#a revalidated response is fresh again
+		with self.lock:
+			self.db.execute("UPDATE responses SET fetched = ?, accessed = ? WHERE url = ?", (time.time(), time.time(), url))
+			self.db.commit()
+
+	def evict(self):
+		total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+		if total <= self.max_size:
+			return
+		for url, size in self.db.execute("SELECT url, size FROM responses ORDER BY accessed").fetchall():
+			self.db.execute("DELETE FROM responses WHERE url = ?", (url,))
+			total -= size
+			if total <= self.max_size:
+				break
+
+def open_url(session, method, req_url, end_date):
+	"""
+	Yield the response body of req_url in chunks, from the cache when the
+	cached copy was fetched after the date window closed or is younger than
+	CACHE_TTL, otherwise with a conditional request.
+	"""
+	print("req_url:"+req_url)
+	key = method + " " + req_url
+	cached = response_cache.get(key) if response_cache else None
+	headers = {}
+	if cached:
+		body, etag, last_modified, fetched = cached
+		#only a response fetched after the window closed is final
+		if fetched >= closed_at(end_date) or time.time() - fetched < CACHE_TTL:
+			yield body
+			return
+		if etag:
+			headers["If-None-Match"] = etag
+		if last_modified:
+			headers["If-Modified-Since"] = last_modified
+
+	if rate_limiter:
+		rate_limiter.acquire()
+	throttled = False
+	retry_after = 0
+	try:
+		with session.request(method, req_url, headers=headers, stream=True) as resp:
+			print(resp)
+			if resp.status_code == 304 and cached:
+				response_cache.touch(key)
+				yield cached[0]
+				return
+			if resp.status_code in RETRY_STATUS:
+				throttled = resp.status_code in THROTTLE_STATUS
+				retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+				raise RetryableError("http request filed! " + str(resp.status_code) + " " + req_url, retry_after)
+			if resp.status_code != 200:
+				raise FetchError("http request filed! " + str(resp.status_code) + " " + req_url)
+			chunks = []
+			for chunk in resp.iter_content(chunk_size=65536):
+				if response_cache:
+					chunks.append(chunk)
+				yield chunk
+			if response_cache:
+				response_cache.put(key, b"".join(chunks), resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+	finally:
+		if rate_limiter:
+			rate_limiter.release(throttled, retry_after)
+
+def decode_stream(chunks, encoding="utf-8"):
+	decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+	for chunk in chunks:
+		yield decoder.decode(chunk)
+	yield decoder.decode(b"", final=True)
+
+def read_page(session, req_url, start_date, end_date):
+	return get_title(decode_stream(open_url(session, "GET", req_url, end_date)), start_date, end_date)
+
+def fetch_page(session, req_url, start_date, end_date):
+	saved = checkpoint.get(req_url) if checkpoint else None
+	if saved:
+		return saved
+	[page_total_list, flag] = retry_call(read_page, session, req_url, start_date, end_date)
+	if checkpoint:
+		checkpoint.put(req_url, page_total_list, flag)
+	return [page_total_list, flag]
+
+def fetch_messages(session, query_url, start_date, end_date, jobs):
+	"""
+	Fetch the result pages of query_url with up to jobs offsets in flight.
+	The pages are consumed in order and the fetch stops at the first page
+	where the date window is exhausted.
+	"""
+	total_list = []
+	offsets = iter(range(0, sys.maxsize, PAGE_SIZE))
+	with ThreadPoolExecutor(jobs) as pool:
+		pending = deque()
+		for _ in range(jobs):
+			pending.append(pool.submit(fetch_page, session, query_url + "&o=" + str(next(offsets)), start_date, end_date))
+		try:
+			while pending:
+				[page_total_list, flag] = pending.popleft().result()
+				print("page_total_list count:", len(page_total_list))
+				total_list += page_total_list
+				#check target date is over or not
+				if not flag:
+					break
+				pending.append(pool.submit(fetch_page, session, query_url + "&o=" + str(next(offsets)), start_date, end_date))
+		finally:
+			#the pages after the last one are not needed
+			for future in pending:
+				future.cancel()
+	return total_list
+
+msgid_re = re.compile(r"<([^<>\s]+)>")
+
+def mbox_message(header_bytes):
+	#build the Message from the header block of one mail of the mbox
+	headers = email.parser.BytesHeaderParser(policy=email.policy.default).parsebytes(header_bytes)
+	try:
+		subject = " ".join(str(headers.get("Subject", "")).split())
+		name, addr = email.utils.parseaddr(str(headers.get("From", "")))
+		msg_date = email.utils.parsedate_to_datetime(str(headers.get("Date", "")))
+	except (TypeError, ValueError, IndexError):
+		return None
+	if msg_date.tzinfo is None:
+		msg_date = msg_date.replace(tzinfo=timezone.utc)
+	msg_date = msg_date.astimezone(timezone.utc)
+	ids = msgid_re.findall(str(headers.get("Message-ID", "")))
+	if not ids:
+		return None
+	refs = msgid_re.findall(str(headers.get("In-Reply-To", "")) + " " + str(headers.get("References", "")))
+	link = "https://lore.kernel.org/all/" + quote(ids[0], safe="!$&'()*+,;=:@")
+	return Message(subject, link, name or addr, msg_date.strftime("%Y-%m-%d %H:%M UTC"), ids[0], tuple(refs))
+
+def read_mbox_headers(chunks):
+	"""
+	Split the mbox stream on the "From " lines and yield the header block of
+	every mail, the bodies are skipped without being kept.
+	"""
+	buf = b""
+	#lines of the current header block, None while in a body
+	header = None
+	for chunk in chunks:
+		buf += chunk
+		lines = buf.split(b"\n")
+		buf = lines.pop()
+		for line in lines:
+			if line.startswith(b"From "):
+				header = []
+			elif header is not None:
+				if line.rstrip(b"\r"):
+					header.append(line)
+				else:
+					yield b"\n".join(header) + b"\n"
+					header = None
+	if header:
+		yield b"\n".join(header) + b"\n"
+
+def gunzip_stream(chunks):
+	#decompress the mbox.gz on the fly, unless the http layer already did it
+	decompressor = None
+	head = b""
+	for chunk in chunks:
+		if decompressor is None:
+			#the gzip magic may be cut between the first chunks
+			head += chunk
+			if len(head) < 2:
+				continue
+			decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if head[:2] == b"\x1f\x8b" else False
+			chunk = head
+		if decompressor:
+			yield decompressor.decompress(chunk)
+		else:
+			yield chunk
+	if decompressor is None:
+		yield head
+	elif decompressor:
+		yield decompressor.flush()
+
+def fetch_mbox_messages(session, query_url, start_date, end_date):
+	"""
+	Download all the results of query_url as one mbox.gz (x=m of public-inbox)
+	and parse the From/Date/Subject/Message-ID/In-Reply-To/References headers
+	while the stream is decompressed.
+	"""
+	req_url = query_url + "&x=m"
+	total_list = []
+	for header_bytes in read_mbox_headers(gunzip_stream(open_url(session, "POST", req_url, end_date))):
+		message = mbox_message(header_bytes)
+		if message is None or "[PATCH" not in message.subject:
+			continue
+		if is_date_between(start_date, end_date, date.fromisoformat(message.date[:10])):
+			total_list.append(message)
+	#latest first like the result pages
+	total_list.sort(key=lambda message: message.date, reverse=True)
+	print("mbox messages count:", len(total_list))
+	return total_list
+
+def fetch_query(session, query_url, start_date, end_date, jobs, backend):
+	if backend == "mbox":
+		return retry_call(fetch_mbox_messages, session, query_url, start_date, end_date)
+	return fetch_messages(session, query_url, start_date, end_date, jobs)
+
+def fetch_window(session, url_path, start_date, end_date, jobs, backend, period):
+	if period:
+		return fetch_split_messages(session, url_path, start_date, end_date, period, jobs, backend)
+	return fetch_query(session, url_path + "+d%3A" + str(start_date) + ".." + str(end_date), start_date, end_date, jobs, backend)
+
+class MessageStore:
+	"""
+	Local sqlite store of the parsed messages, indexed on the date, the mail
+	domain of the -f query and the normalized subject. The days that are
+	completely fetched are recorded per domain, so overlapping monthly,
+	quarterly and yearly reports only fetch the days they have not seen.
+	"""
+	def __init__(self, store_file):
+		self.db = sqlite3.connect(store_file)
+		#a message matches several -f entries for a domain and an address in it, it is kept for each of them
+		self.db.execute("CREATE TABLE IF NOT EXISTS messages (link TEXT, subject TEXT, norm_subject TEXT, author TEXT, "
+			"date TEXT, day TEXT, domain TEXT, msgid TEXT, refs TEXT, PRIMARY KEY (domain, link))")
+		self.db.execute("CREATE INDEX IF NOT EXISTS messages_domain_day ON messages (domain, day)")
+		self.db.execute("CREATE INDEX IF NOT EXISTS messages_norm_subject ON messages (norm_subject)")
+		self.db.execute("CREATE TABLE IF NOT EXISTS synced (domain TEXT, day TEXT, PRIMARY KEY (domain, day))")
+
+	def missing_ranges(self, domain, start_date, end_date):
+		#contiguous ranges of the days not synced yet, the latest first
+		synced = set(row[0] for row in self.db.execute("SELECT day FROM synced WHERE domain = ? AND day BETWEEN ? AND ?",
+			(domain, str(start_date), str(end_date))))
+		ranges = []
+		day = start_date
+		while day <= end_date:
+			if str(day) not in synced:
+				if ranges and ranges[-1][1] == day - timedelta(days=1):
+					ranges[-1] = (ranges[-1][0], day)
+				else:
+					ranges.append((day, day))
+			day += timedelta(days=1)
+		ranges.reverse()
+		return ranges
+
+	def add(self, domain, messages, start_date, end_date):
+		self.db.executemany("INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+			[(info.link, info.subject, normalize_subject(info.subject), info.author, info.date, info.date[:10],
+			domain, info.msgid, " ".join(info.refs)) for info in messages])
+		#the days not closed yet are fetched again next time
+		day = start_date
+		while day <= end_date and is_closed(day):
+			self.db.execute("INSERT OR IGNORE INTO synced VALUES (?, ?)", (domain, str(day)))
+			day += timedelta(days=1)
+		self.db.commit()
+
+	def messages(self, domain, start_date, end_date):
+		#latest first like the result pages
+		rows = self.db.execute("SELECT subject, link, author, date, msgid, refs FROM messages "
+			"WHERE domain = ? AND day BETWEEN ? AND ? ORDER BY date DESC, rowid", (domain, str(start_date), str(end_date)))
+		return [Message(row[0], row[1], row[2], row[3], row[4], tuple(row[5].split())) for row in rows]
+
+def parse_domains(arg):
+	#"a.com,b.com" or "@file" with one domain/address per line, # for comments
+	if arg.startswith("@"):
+		with open(arg[1:]) as f:
+			names = [line.split("#")[0].strip() for line in f]
+	else:
+		names = [name.strip() for name in arg.split(",")]
+	return list(dict.fromkeys(name for name in names if name))
+
+def sheet_labels(domains):
+	#sheet names are at most 31 characters and unique ignoring the case,
+	#the domains that are the same in the first 20 characters get their index
+	labels = []
+	used = set()
+	for index, domain in enumerate(domains, 1):
+		label = domain[:20]
+		if label.lower() in used:
+			label = domain[:19 - len(str(index))] + "#" + str(index)
+		used.add(label.lower())
+		labels.append(label)
+	return labels
+
+def domain_url(domain):
+	return "https://lore.kernel.org/all/?q=f:" + domain
+
+def fetch_domain(session, domain, start_date, end_date, store):
+	url = domain_url(domain) if domain else url_path
+	if store is None:
+		return fetch_window(session, url, start_date, end_date, jobs, backend, split_period)
+	for sub_start, sub_end in store.missing_ranges(domain, start_date, end_date):
+		store.add(domain, fetch_window(session, url, sub_start, sub_end, jobs, backend, split_period), sub_start, sub_end)
+	return store.messages(domain, start_date, end_date)
+
+def split_date_range(start_date, end_date, period):
+	#sub-ranges of the month or week, the latest first like the lore results
+	ranges = []
+	sub_start = start_date
+	while sub_start <= end_date:
+		if period == "week":
+			sub_end = sub_start + timedelta(days=6)
+		else:
+			last_day = get_last_day_of_month(sub_start.strftime("%Y-%m"))
+			sub_end = sub_start.replace(day=last_day)
+		sub_end = min(sub_end, end_date)
+		ranges.append((sub_start, sub_end))
+		sub_start = sub_end + timedelta(days=1)
+	ranges.reverse()
+	return ranges
+
+def fetch_split_messages(session, url_path, start_date, end_date, period, jobs, backend):
+	"""
+	Run one query per month or week of the date range concurrently, each
+	sub-query pages serially so no more than jobs requests are in flight.
+	The results are merged in date order and deduped by message link.
+	"""
+	ranges = split_date_range(start_date, end_date, period)
+	total_list = []
+	links = set()
+	with ThreadPoolExecutor(jobs) as pool:
+		futures = [pool.submit(fetch_query, session, url_path + "+d%3A" + str(sub_start) + ".." + str(sub_end),
+			sub_start, sub_end, 1, backend) for sub_start, sub_end in ranges]
+		for future in futures:
+			for info in future.result():
+				if info[1] not in links:
+					links.add(info[1])
+					total_list.append(info)
+	return total_list
+
 if __name__ == '__main__':
 	opt_flag = ""
 	try:
-		opts, args = getopt.getopt(sys.argv[1:], "f:y:s:e:m:hv", ["help","version"])
+		opts, args = getopt.getopt(sys.argv[1:], "f:y:s:e:m:j:p:b:d:hv", ["help","version","no-cache"])
 	except getopt.GetoptError as err:
 		print(err)
 		print(usage.__doc__)
@@ -117,8 +760,9 @@ if __name__ == '__main__':
 			print(usage.__doc__)
 			sys.exit()
 		elif opt in ("-f"):
-			url_path = "https://lore.kernel.org/all/?q=f:" + arg
-			print("Current url path:"+url_path)
+			mail_domains = parse_domains(arg)
+			for domain in mail_domains:
+				print("Current url path:" + domain_url(domain))
 		elif opt in ("-y"):
 			target_year_str = arg.strip(" ")
 			opt_flag = "one_year"
@@ -131,6 +775,22 @@ if __name__ == '__main__':
 		elif opt in ("-m"):
 			opt_flag = "one_month"
 			target_month_str = arg.strip(" ")
+		elif opt in ("-j"):
+			jobs = min(max(int(arg), 1), MAX_JOBS)
+		elif opt in ("-p"):
+			if arg not in ("month", "week"):
+				print("Pls input month or week for -p!")
+				sys.exit(2)
+			split_period = arg
+		elif opt in ("-b"):
+			if arg not in ("html", "mbox"):
+				print("Pls input html or mbox for -b!")
+				sys.exit(2)
+			backend = arg
+		elif opt in ("--no-cache",):
+			CACHE_FILE = ""
+		elif opt in ("-d"):
+			store_file = arg
 		elif opt in ("-v", "--version"):
 			print(VERSION)
 			sys.exit()
@@ -141,10 +801,8 @@ if __name__ == '__main__':
 	if opt_flag == "one_year":
 		start_date = datetime.strptime(target_year_str + "-01-01", "%Y-%m-%d").date()
 		end_date = datetime.strptime(target_year_str + "-12-31", "%Y-%m-%d").date()
-		search_date = target_year_str + "-01-01.." + target_year_str + "-12-31"
 		report_file = target_year_str + "_result.xls"
 	elif opt_flag == "between":
-		search_date = start_date_str + ".." + end_date_str
 		start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
 		end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date()
 		report_file = start_date_str + "_" + end_date_str + "_result.xls"
@@ -152,85 +810,75 @@ if __name__ == '__main__':
 		start_date = datetime.strptime(target_month_str + "-01", "%Y-%m-%d").date()
 		last_day = get_last_day_of_month(target_month_str)
 		end_date = datetime.strptime(target_month_str + "-" + str(last_day), "%Y-%m-%d").date()
-		search_date = str(start_date) + ".." + str(end_date)
 		report_file = target_month_str + "_result.xls"
 	else:
 		print( "Pls input date parameter!")
 		print(usage.__doc__)
 		sys.exit()
 
-	headers = {
-		'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
-		'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-		'Accept-Language': 'en-US,en;q=0.5',
-		'Referer': 'https://lore.kernel.org/',
-		'Connection': 'keep-alive',
-	}
-	page_total_list = []
-	total_list = []
-	title_only_list = []
-	new_total_list = []
-	submission_list = []
-	replay_list = []
-	review_list = []
-	page_index = 0
-	while 1:
-		req_url = url_path + "+d%3A"+ search_date + "&o=" + str(page_index)
-		print("req_url:"+req_url)
-		resp = requests.get(req_url, headers=headers)
-		print(resp)
-		if resp.status_code == 200:
-			[page_total_list, flag] = get_title(resp.text, start_date, end_date)
-			print("page_total_list count:", len(page_total_list))
-			total_list += page_total_list
-			#check target month is over or not
-			if flag:
-				page_index += 200 #each request for 200 items
-			else:
-				break
-		else:
-			print("http request filed!")
-			sys.exit(2)
+	#all the domains share one keep-alive session, the pages of each domain are fetched with -j jobs
+	session = new_session(jobs)
+	if CACHE_FILE:
+		response_cache = ResponseCache(CACHE_FILE)
+	rate_limiter = RateLimiter(jobs)
+	#the same command line resumes its own pages
+	checkpoint = PageCheckpoint(CHECKPOINT_FILE, " ".join(sys.argv[1:]))
+	store = MessageStore(store_file) if store_file else None
+	domain_lists = []
+	try:
+		for domain in mail_domains or [""]:
+			domain_lists.append((domain, fetch_domain(session, domain, start_date, end_date, store)))
+	except (FetchError, requests.RequestException) as err:
+		print(err)
+		print("Pls run the same command again to resume from the failed page")
+		sys.exit(2)
 
-	#split replay and submission
-	for info in total_list:
-		if info[0] not in title_only_list:
-			title_only_list.append(info[0])
-			new_total_list.append(info)
+	book = xlwt.Workbook(encoding='utf-8', style_compression=0)
+	if len(domain_lists) == 1:
+		#split replay and submission
+		[new_total_list, submission_list, replay_list, review_list] = classify_messages(domain_lists[0][1])
 
-	for info in new_total_list:
-		if "Re: " in info[0]:
-			replay_list.append(info)
-		else:
-			submission_list.append(info)
+		print("Results as below:")
+		print("total_list count:", len(new_total_list))
+		print("submission_list:", len(submission_list))
+		print("replay_list:", len(replay_list))
+		print("review_list:", len(review_list))
 
-	for info1 in replay_list:
-		flag = 0
-		for info2 in submission_list:
-			if info2[0] in info1[0]:
-				flag = 1
-				break;
-		if (flag == 0): #replay is not in submission list
-			review_list.append(info1)
-
-	print("Results as below:")
-	print("total_list count:", len(new_total_list))
-	print("submission_list:", len(submission_list))
-	print("replay_list:", len(replay_list))
-	print("review_list:", len(review_list))
-
-	#write the total result to excel file
-	book = xlwt.Workbook(encoding='utf-8', style_compression=0)
-	write_sheet(book, "Total", new_total_list)
+		#write the total result to excel file
+		write_sheet(book, "Total", new_total_list)
 
-	#write the submission result to excel file
-	write_sheet(book, "Submission", submission_list)
+		#write the submission result to excel file
+		write_sheet(book, "Submission", submission_list)
 
-	#write the replay result to excel file
-	write_sheet(book, "Reply", replay_list)
+		#write the replay result to excel file
+		write_sheet(book, "Reply", replay_list)
 
-	#write the review result to excel file
-	write_sheet(book, "Review", review_list)
+		#write the review result to excel file
+		write_sheet(book, "Review", review_list)
+	else:
+		#Summary first, then Total/Submission/Reply/Review of every domain
+		summary = []
+		results = []
+		all_list = []
+		seen = set()
+		for domain, total_list in domain_lists:
+			lists = classify_messages(total_list)
+			results.append((domain, lists))
+			summary.append([domain] + [len(name_list) for name_list in lists])
+			print(domain, "total/submission/reply/review:", *summary[-1][1:])
+			#the same message matches several -f entries for a domain and an address in it
+			for info in total_list:
+				if info.link not in seen:
+					seen.add(info.link)
+					all_list.append(info)
+		all_list.sort(key=lambda info: info.date, reverse=True)
+		summary.append(["All"] + [len(name_list) for name_list in classify_messages(all_list)])
+		print("All total/submission/reply/review:", *summary[-1][1:])
+		write_summary(book, summary)
+		for label, (domain, lists) in zip(sheet_labels([domain for domain, lists in results]), results):
+			for kind, name_list in zip(("Total", "Submission", "Reply", "Review"), lists):
+				write_sheet(book, label + " " + kind, name_list)
 
 	book.save(report_file)
+	checkpoint.clear()
 
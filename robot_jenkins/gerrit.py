@@ -1,14 +1,17 @@
 #!/usr/bin/python3
 # -*- coding: UTF-8 -*-
 
+import asyncio
 import requests
 import json
+import threading
 import urllib3
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
 import re
 
 class Gerrit:
-    def __init__(self, gerrit_url=None, username=None, password=None):
+    def __init__(self, gerrit_url=None, username=None, password=None, pool_size=4):
  
         if (gerrit_url is None):
             raise
@@ -16,9 +19,23 @@ class Gerrit:
         self.URL_SUFFIX_REST = "https://" + gerrit_url + "/a"
         self.URL_SUFFIX_HTTP = "https://" + gerrit_url
         self.xmlProjectBranch={}
+        self.gerrit_url = gerrit_url
+        self.username = username
+        self.password = password
  
+        # one keep-alive pool for the whole batch, the login is only repeated when it expires
         self.session = requests.Session()
-        self.header_query = {
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.login_lock = threading.Lock()
+        self.login_count = 0
+ 
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        self.login()
+
+    def login(self):
+        gerrit_url = self.gerrit_url
+        header_query = {
             'Host': gerrit_url,
             'Connection': 'keep-alive',
             'Content-Type': 'application/x-www-form-urlencoded',
@@ -27,27 +44,42 @@ class Gerrit:
             'Accept-Language': 'en-US,en;',
         }
  
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
- 
         login_url = 'https://' + gerrit_url +'/login/'
  
-        r = self.session.get(login_url, headers=self.header_query, verify=False)
+        r = self.session.get(login_url, headers=header_query, verify=False)
  
-        data = 'username=%s&password=%s' %(username, quote(password, 'utf-8'))
+        data = 'username=%s&password=%s' %(self.username, quote(self.password, 'utf-8'))
  
-        r = self.session.post(login_url, data, headers=self.header_query)
+        r = self.session.post(login_url, data, headers=header_query)
  
-        self.session_cookies = r.cookies
+        session_cookies = r.cookies
  
-        self.header_set = self.header_query.copy()
-        self.header_set.update({'Content-Type': 'application/json;charset=UTF-8'})
+        header_set = header_query.copy()
+        header_set.update({'Content-Type': 'application/json;charset=UTF-8'})
  
         if 'scgit' in gerrit_url: # gerrit version 2.11
             x_gerrit_auth = re.findall(r'xGerritAuth="(.*)";', str(r.content))[0]
         else: # gerrit version 2.16
             x_gerrit_auth = r.cookies.get_dict()['XSRF_TOKEN']
-        self.header_set.update({"x-gerrit-auth": x_gerrit_auth})
-        self.header_query.update({"x-gerrit-auth": x_gerrit_auth})
+        header_set.update({"x-gerrit-auth": x_gerrit_auth})
+        header_query.update({"x-gerrit-auth": x_gerrit_auth})
+        # swapped in at once, the other threads never see a half done login
+        self.header_query, self.header_set, self.session_cookies = header_query, header_set, session_cookies
+        self.login_count += 1
+
+    def _request(self, method, url, json_body=False, **kwargs):
+        # log in again once when the session expired (401/403), the other threads reuse the new login
+        login_count = self.login_count
+        headers = self.header_set if json_body else self.header_query
+        r = self.session.request(method, url, headers=headers, cookies=self.session_cookies, **kwargs)
+        if r.status_code in (401, 403):
+            with self.login_lock:
+                if self.login_count == login_count:
+                    print("Gerrit login expired, log in again")
+                    self.login()
+            headers = self.header_set if json_body else self.header_query
+            r = self.session.request(method, url, headers=headers, cookies=self.session_cookies, **kwargs)
+        return r
 
     def _decode_response(self, ret):
         content = ret.strip()
@@ -65,17 +97,17 @@ class Gerrit:
 
     def _get_rest(self, api):
         url = self.URL_SUFFIX_REST + api
-        r = self.session.get(url, headers=self.header_query, cookies=self.session_cookies)
+        r = self._request('GET', url)
         return self._decode_response(r.text)
 
     def _get_http(self, api):
         url = self.URL_SUFFIX_HTTP + api
-        r = self.session.get(url, headers=self.header_query, cookies=self.session_cookies)
+        r = self._request('GET', url)
         return self._decode_response(r.text)
 
     def _post_rest(self, api, data,returnRawData=False):
         url = self.URL_SUFFIX_REST + api
-        r = self.session.post(url, data=json.dumps(data), headers=self.header_set, cookies=self.session_cookies)
+        r = self._request('POST', url, json_body=True, data=json.dumps(data))
         if returnRawData:
             return self._decode_response(r.text),r.text
         else:
@@ -83,7 +115,7 @@ class Gerrit:
 
     def _put_rest(self, api, data,returnRawData=False):
         url = self.URL_SUFFIX_REST + api
-        r = self.session.put(url, data=json.dumps(data), headers=self.header_set, cookies=self.session_cookies)
+        r = self._request('PUT', url, json_body=True, data=json.dumps(data))
         if returnRawData:
             return self._decode_response(r.text),r.text
         else:
@@ -105,17 +137,97 @@ class Gerrit:
         print(api)
         return self._get_rest(api)
 
-    def post_review_pass_message(self, cl_id, messages):
-            cl_review_info_dic = self.get_review(cl_id)
-            try:
-                api = '/changes/%s/revisions/%s/review' %(cl_id, cl_review_info_dic['current_revision'])
-                print(api)
-            except:
+    def get_current_revision(self, cl_id):
+        # one request instead of the detail and review of get_review
+        api = '/changes/%s?o=CURRENT_REVISION' %cl_id
+        print(api)
+        change = self._get_rest(api)
+        if not isinstance(change, dict):
+            return None
+        return change.get('current_revision')
+
+    def post_review_pass_message(self, cl_id, messages, revision=None):
+            if revision is None:
+                revision = self.get_current_revision(cl_id)
+            if revision is None:
                 return "{'INFO' :'CL was rebased or submited but not verify +2}"
+            api = '/changes/%s/revisions/%s/review' %(cl_id, revision)
+            print(api)
             data = {
                 "message": messages,
                 "labels": {
                     "Verified": "+2",
                 }
             }
-            return self._post_rest(api, data)
\ No newline at end of file
+            return self._post_rest(api, data)
+
+class AsyncGerrit:
+    """
+    asyncio front end of a logged in Gerrit: the blocking REST calls run on
+    a thread pool over the keep-alive session of the Gerrit, at most
+    concurrency of them in flight, the responses are decoded the same way.
+    """
+    def __init__(self, gerrit, concurrency=4):
+        self.gerrit = gerrit
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(concurrency)
+        self.semaphore = None
+
+    async def _call(self, func, *args):
+        # the semaphore belongs to the running event loop, create it there
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def _get_rest(self, api):
+        return await self._call(self.gerrit._get_rest, api)
+
+    async def _post_rest(self, api, data):
+        return await self._call(self.gerrit._post_rest, api, data)
+
+    async def _put_rest(self, api, data):
+        return await self._call(self.gerrit._put_rest, api, data)
+
+    async def query_changes(self, queries, options=('CURRENT_REVISION',)):
+        # all the queries in one /changes/ call, one list of changes per query
+        if not queries:
+            return []
+        api = '/changes/?' + '&'.join('q=%s' %query for query in queries)
+        api += ''.join('&o=%s' %option for option in options)
+        print(api)
+        result = await self._get_rest(api) or []
+        if len(queries) == 1:
+            return [result]
+        return result
+
+    async def get_current_revisions(self, cl_ids, chunk_size=50):
+        # change:A+OR+change:B queries of chunk_size changes, the queries of one call run on the server
+        cl_ids = list(cl_ids)
+        queries = ['+OR+'.join('change:%s' %cl_id for cl_id in cl_ids[i:i + chunk_size])
+                   for i in range(0, len(cl_ids), chunk_size)]
+        revisions = {}
+        for changes in await self.query_changes(queries):
+            for change in changes:
+                revisions[str(change['_number'])] = change.get('current_revision')
+        return revisions
+
+    async def post_reviews(self, reviews):
+        # reviews: (cl_id, revision, data), posted concurrently, results in the same order
+        return await asyncio.gather(*[self._post_rest('/changes/%s/revisions/%s/review' %(cl_id, revision), data)
+                                      for cl_id, revision, data in reviews])
+
+    async def post_review_pass_messages(self, cl_ids, messages):
+        revisions = await self.get_current_revisions(cl_ids)
+        data = {
+            "message": messages,
+            "labels": {
+                "Verified": "+2",
+            }
+        }
+        reviews = [(cl_id, revisions[str(cl_id)], data) for cl_id in cl_ids if revisions.get(str(cl_id))]
+        results = dict(zip([review[0] for review in reviews], await self.post_reviews(reviews)))
+        return [results.get(cl_id, "{'INFO' :'CL was rebased or submited but not verify +2}") for cl_id in cl_ids]
+
+    def close(self):
+        self.executor.shutdown()
@@ -1,19 +1,75 @@
 #!/usr/bin/python3
 # -*- coding: UTF-8 -*-
 
+import asyncio
 import configparser
+import getopt
 import hashlib
 import imaplib
 import email
+import email.parser
+import json
 import os
+import queue
+import select
+import sqlite3
+import ssl
+import sys
+import tempfile
+import threading
+import time
 from email.header import decode_header
 from datetime import datetime
 import subprocess
-from gerrit import Gerrit
+from concurrent.futures import ThreadPoolExecutor
+from gerrit import AsyncGerrit, Gerrit
 import re
 
 VERSION = "2025.3"
 CONFIG_FILE = 'conf.ini'
+jobs = 4
+daemon = False
+# IDLE is restarted before the 29 minutes servers may drop an idle client
+IDLE_TIMEOUT = 25 * 60
+# the fallback when the server has no IDLE
+POLL_INTERVAL = 30
+RECONNECT_MAX = 300
+# UIDs per FETCH command
+FETCH_BATCH = 200
+# a patch series that is still incomplete after this long is given up
+SERIES_WAIT = 24 * 3600
+# one logged in gerrit client for all the batches
+gerrit_client = None
+gerrit_lock = threading.Lock()
+VERIFY_MESSAGE = "Auto Verified by AMLRobot"
+
+def usage():
+    """
+Fetch the unread PATCH mails, apply every patch on the gerrit branch, push it
+to gerrit and set Verified +2.
+Usage: ./robot-jenkins.py [-c conf.ini] [-j jobs] [-d [-t seconds]]
+
+Every worker owns a git worktree of CODE_BASE_DIR under WORKTREE_DIR (default
+CODE_BASE_DIR-worktrees). The branch is fetched once per batch and every patch
+is applied on that pinned tip after a git apply --check, the pushes to gerrit
+are done one at a time. Only the mails above the last UID kept in STATE_FILE
+(default OUTPUT_DIR/.uid_state) are fetched, BODYSTRUCTURE first and then only
+the .patch or text/plain parts. Every patch mail is recorded in LEDGER_FILE
+(default OUTPUT_DIR/ledger.db) by Message-ID and git patch-id, a committed patch
+is never applied twice, a failed one is tried again when it is sent again and the
+ones left unfinished by a crash are resumed. The [PATCH n/m] mails of a thread
+are kept until the series is complete, then applied in order on one base and
+pushed with a single git push.
+
+Description
+    -h --help           display help information
+    -c <config_file>    config file, default conf.ini
+    -j <jobs>           patches processed concurrently, default 4
+    -d                  daemon mode, keep one IMAP connection and wait for new mail with
+                        IDLE, reconnect when the connection is lost
+    -t <seconds>        poll interval of the daemon when the server has no IDLE, default 30
+    -v --version        version information
+"""
 
 def load_config():
     config = configparser.ConfigParser()
@@ -30,7 +86,11 @@ def load_config():
         'gerrit_username': config['GERRIT']['USERNAME'],
         'gerrit_password': config['GERRIT']['PASSWORD'],
         'output_dir': config.get('DEFAULT', 'OUTPUT_DIR', fallback='patches'),
-        'code_base_dir': config['DEFAULT']['CODE_BASE_DIR']
+        'state_file': config.get('DEFAULT', 'STATE_FILE', fallback=''),
+        'ledger_file': config.get('DEFAULT', 'LEDGER_FILE', fallback=''),
+        'code_base_dir': config['DEFAULT']['CODE_BASE_DIR'],
+        'worktree_dir': config.get('DEFAULT', 'WORKTREE_DIR',
+                                   fallback=config['DEFAULT']['CODE_BASE_DIR'].rstrip('/') + '-worktrees')
     }
 
 def connect_mail_server(config):
@@ -42,35 +102,423 @@ def connect_mail_server(config):
         print(f"详细错误信息: {str(e)}")
         raise
 
-def process_emails(mail, output_dir):
-    mail.select('INBOX')
-    files = []
+def imap_tokens(data):
+    # tokens of the imaplib FETCH response, the (prefix, literal) tuples carry the literals
+    token_re = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{\d+\}$|([^\s()"\[]+(?:\[[^\]]*\](?:<\d+>)?)?))')
+    for item in data:
+        if isinstance(item, tuple):
+            text, literal = item
+        else:
+            text, literal = item, None
+        pos = 0
+        while pos < len(text):
+            match = token_re.match(text, pos)
+            if not match or match.end() == pos:
+                break
+            pos = match.end()
+            if match.group(1):
+                yield '('
+            elif match.group(2):
+                yield ')'
+            elif match.group(3) is not None:
+                yield re.sub(rb'\\(.)', rb'\1', match.group(3))
+            elif match.group(4):
+                yield None if match.group(4).upper() == b'NIL' else match.group(4)
+        if literal is not None:
+            yield literal
+
+def parse_fetch_response(data):
+    # {uid: {item name: value}} of a UID FETCH, lists are nested python lists
+    stack = [[]]
+    for token in imap_tokens(data):
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        else:
+            stack[-1].append(token)
+    messages = {}
+    for value in stack[0]:
+        if not isinstance(value, list):
+            continue
+        items = dict((value[i].upper(), value[i + 1]) for i in range(0, len(value) - 1, 2)
+                     if isinstance(value[i], bytes))
+        if b'UID' in items:
+            messages[int(items[b'UID'])] = items
+    return messages
+
+def fetch_item(items, name):
+    # the servers echo BODY[HEADER.FIELDS (...)] with their own spacing, match on the section
+    for key, value in items.items():
+        if key.split(b' ')[0].split(b'<')[0] == name or key.startswith(name + b' '):
+            return value
+    return None
 
-    status, messages = mail.search(None, '(UNSEEN SUBJECT "PATCH")')
+def imap_params(values):
+    if not isinstance(values, list):
+        return {}
+    return dict((values[i].decode('utf-8', 'replace').lower(), values[i + 1].decode('utf-8', 'replace'))
+                for i in range(0, len(values) - 1, 2) if values[i] and values[i + 1])
+
+def body_parts(structure, prefix=''):
+    # yield (part number, type, subtype, params, encoding, disposition, disposition params) of the BODYSTRUCTURE leaves
+    if isinstance(structure[0], list):
+        # multipart: the parts come first, then the subtype and the extension data
+        for i, child in enumerate(structure, 1):
+            if not isinstance(child, list):
+                break
+            yield from body_parts(child, prefix + str(i) + '.')
+        return
+    content_type = (structure[0] or b'').decode().lower()
+    subtype = (structure[1] or b'').decode().lower()
+    if content_type == 'message' and subtype == 'rfc822':
+        return
+    # text has the line count before the extension data
+    disposition_index = 9 if content_type == 'text' else 8
+    disposition = structure[disposition_index] if len(structure) > disposition_index else None
+    if isinstance(disposition, list) and disposition:
+        disposition_type = (disposition[0] or b'').decode().lower()
+        disposition_params = imap_params(disposition[1] if len(disposition) > 1 else None)
+    else:
+        disposition_type, disposition_params = '', {}
+    yield (prefix[:-1] or '1', content_type, subtype, imap_params(structure[2]),
+           (structure[5] or b'7bit').decode().lower(), disposition_type, disposition_params)
+
+def is_patch_attachment(part):
+    number, content_type, subtype, params, encoding, disposition_type, disposition_params = part
+    filename = disposition_params.get('filename') or params.get('name') or ''
+    return disposition_type == 'attachment' and filename.endswith('.patch')
+
+def wanted_parts(structure):
+    # the .patch attachment, else the text/plain parts that may carry the diff
+    text_parts = []
+    for part in body_parts(structure):
+        if is_patch_attachment(part):
+            return [part]
+        if part[1] == 'text' and part[2] == 'plain':
+            text_parts.append(part)
+    return text_parts
+
+def decode_part(part, data):
+    # feed the part to the parser as it is read, with the headers taken from BODYSTRUCTURE
+    number, content_type, subtype, params, encoding, disposition_type, disposition_params = part
+    parser = email.parser.BytesFeedParser()
+    parser.feed(f"Content-Type: {content_type}/{subtype}\r\nContent-Transfer-Encoding: {encoding}\r\n\r\n".encode())
+    for i in range(0, len(data), 65536):
+        parser.feed(data[i:i + 65536])
+    return parser.close().get_payload(decode=True).decode('utf-8')
+
+def uid_sets(uids):
+    # "1:5,8" message sets of at most FETCH_BATCH UIDs
+    for i in range(0, len(uids), FETCH_BATCH):
+        ranges = []
+        for uid in uids[i:i + FETCH_BATCH]:
+            if ranges and ranges[-1][1] == uid - 1:
+                ranges[-1][1] = uid
+            else:
+                ranges.append([uid, uid])
+        yield ','.join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+def load_uid_state(state_file, uidvalidity):
+    # the UIDs are only valid as long as UIDVALIDITY of the mailbox does not change
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if state.get('uidvalidity') != uidvalidity:
+        return 0
+    return state.get('last_uid', 0)
+
+def save_uid_state(state_file, uidvalidity, last_uid):
+    with open(state_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'uidvalidity': uidvalidity, 'last_uid': last_uid}, f)
+    os.replace(state_file + '.tmp', state_file)
+
+def fetch_patches(mail, uids):
+    # yield (uid, headers, patch content), one BODYSTRUCTURE + headers FETCH per UID set and
+    # one FETCH per set of messages with the same wanted parts
+    for uid_set in uid_sets(uids):
+        typ, data = mail.uid('FETCH', uid_set, '(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (SUBJECT MESSAGE-ID IN-REPLY-TO REFERENCES)])')
+        heads = parse_fetch_response(data)
+        wanted = {}
+        by_sections = {}
+        for uid, items in sorted(heads.items()):
+            structure = items.get(b'BODYSTRUCTURE')
+            if not isinstance(structure, list):
+                # no usable BODYSTRUCTURE, the whole message
+                wanted[uid] = []
+            else:
+                wanted[uid] = wanted_parts(structure)
+                if not wanted[uid]:
+                    continue
+            by_sections.setdefault(tuple(part[0] for part in wanted[uid]), []).append(uid)
+        for numbers, section_uids in by_sections.items():
+            sections = ' '.join(f"BODY.PEEK[{number}]" for number in numbers) or 'BODY.PEEK[]'
+            for section_set in uid_sets(section_uids):
+                typ, data = mail.uid('FETCH', section_set, f"(UID {sections})")
+                for uid, items in sorted(parse_fetch_response(data).items()):
+                    parts = wanted[uid]
+                    headers = email.message_from_bytes(fetch_item(heads[uid], b'BODY[HEADER.FIELDS') or b'')
+                    try:
+                        if not parts:
+                            patch_content = extract_patch_content(email.message_from_bytes(fetch_item(items, b'BODY[]')))
+                        else:
+                            patch_content = None
+                            for part in parts:
+                                body = decode_part(part, fetch_item(items, f"BODY[{part[0]}]".encode()) or b'')
+                                # other text/plain attachments like a log.txt need the diff too
+                                if is_patch_attachment(part) or 'diff --git' in body:
+                                    patch_content = body
+                                    break
+                    except Exception as e:
+                        print(f"error: {uid}: {str(e)}")
+                        continue
+                    if patch_content:
+                        yield uid, headers, patch_content
+
+def patch_id(patch_content):
+    # git patch-id --stable of the diff, the same change sent again gets the same id
+    result = subprocess.run(['git', 'patch-id', '--stable'], input=patch_content.encode('utf-8'),
+                            capture_output=True)
+    return result.stdout.decode('utf-8').split(' ')[0].strip()
+
+class PatchLedger:
+    """
+    sqlite ledger of the patch mails keyed by Message-ID and git patch-id, with
+    the last stage every patch reached: saved, applied, committed, pushed,
+    verified, failed or duplicate. A patch taken before is never
+    applied again, one that failed is, and the unfinished ones are resumed from their stage, the
+    patches of a [PATCH n/m] series share one series_id.
+    """
+    def __init__(self, ledger_file):
+        os.makedirs(os.path.dirname(ledger_file) or '.', exist_ok=True)
+        self.db = sqlite3.connect(ledger_file, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS patches (msgid TEXT PRIMARY KEY, patch_id TEXT, patch_file TEXT, "
+                        "stage TEXT, commit_sha TEXT, change_id TEXT, error TEXT, updated REAL, "
+                        "series_id TEXT, series_index INTEGER, series_total INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS patches_patch_id ON patches (patch_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS patches_patch_file ON patches (patch_file)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS patches_series_id ON patches (series_id)")
+        self.lock = threading.Lock()
+
+    def seen(self, msgid, patch_id):
+        # a patch that failed before is tried again when it is sent again, one on its way is not
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM patches WHERE msgid = ? OR (patch_id = ? AND patch_id != '' AND "
+                                   "stage NOT IN ('failed', 'duplicate'))",
+                                   (msgid, patch_id)).fetchone() is not None
+
+    def add(self, msgid, patch_id, patch_file, series_id=None, series_index=1, series_total=1):
+        with self.lock:
+            self.db.execute("INSERT INTO patches VALUES (?, ?, ?, 'saved', NULL, NULL, NULL, ?, ?, ?, ?)",
+                            (msgid, patch_id, patch_file, time.time(), series_id or msgid, series_index, series_total))
+            self.db.commit()
+
+    def get(self, patch_file):
+        # (stage, commit_sha, change_id) of the patch file
+        with self.lock:
+            return self.db.execute("SELECT stage, commit_sha, change_id FROM patches WHERE patch_file = ? "
+                                   "ORDER BY updated DESC", (patch_file,)).fetchone()
+
+    def update(self, patch_file, stage, **fields):
+        names = ''.join(f", {name} = ?" for name in fields)
+        with self.lock:
+            self.db.execute(f"UPDATE patches SET stage = ?, updated = ?{names} WHERE patch_file = ?",
+                            [stage, time.time()] + list(fields.values()) + [patch_file])
+            self.db.commit()
+
+    def verified(self, change_ids):
+        with self.lock:
+            self.db.executemany("UPDATE patches SET stage = 'verified', updated = ? WHERE change_id = ?",
+                                [(time.time(), change_id) for change_id in change_ids])
+            self.db.commit()
+
+    def unfinished(self, wait=SERIES_WAIT):
+        """
+        The unfinished patches grouped by series, every series as its patch
+        files in n/m order. A series is complete with all its patches whatever
+        their stage, only the failed and duplicate ones do not count. Incomplete
+        series wait for their missing mails up to wait seconds, a series with two
+        patches for the same n fails and a series whose patches were all handled
+        before under other Message-IDs is marked duplicate.
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT patch_file, COALESCE(series_id, msgid), COALESCE(series_index, 1), "
+                                   "COALESCE(series_total, 1), updated, patch_id, msgid, stage FROM patches "
+                                   "WHERE stage NOT IN ('failed', 'duplicate') AND COALESCE(series_id, msgid) IN "
+                                   "(SELECT COALESCE(series_id, msgid) FROM patches WHERE stage NOT IN "
+                                   "('verified', 'failed', 'duplicate')) ORDER BY updated").fetchall()
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[1], []).append(row)
+        series_list = []
+        for series_id, series_rows in groups.items():
+            total = max(row[3] for row in series_rows)
+            indexes = [row[2] for row in series_rows]
+            # the verified patches are done, only the others are failed or returned
+            pending = [row for row in series_rows if row[7] != 'verified']
+            if len(set(indexes)) < len(indexes):
+                # two mails claim the same n/m, neither one is taken over the other
+                print(f"Series {series_id} has several patches for one n of {total}")
+                for row in pending:
+                    self.update(row[0], 'failed', error='duplicate n')
+                continue
+            if len(indexes) < total:
+                if time.time() - min(row[4] for row in series_rows) > wait:
+                    print(f"Series {series_id} incomplete, {len(indexes)}/{total} patches")
+                    for row in pending:
+                        self.update(row[0], 'failed', error='incomplete series')
+                else:
+                    print(f"Series {series_id} waits for {total - len(indexes)} more patches")
+                continue
+            ordered = sorted(pending, key=lambda row: row[2])
+            if total > 1 and all(self.handled_elsewhere(row[5], row[6]) for row in ordered):
+                print(f"Series {series_id} was already handled")
+                for row in ordered:
+                    self.update(row[0], 'duplicate')
+                continue
+            series_list.append([row[0] for row in ordered])
+        return series_list
+
+    def handled_elsewhere(self, patch_id, msgid):
+        with self.lock:
+            return patch_id != '' and self.db.execute("SELECT 1 FROM patches WHERE patch_id = ? AND msgid != ? AND stage "
+                                                      "IN ('committed', 'pushed', 'verified')",
+                                                      (patch_id, msgid)).fetchone() is not None
+
+msgid_re = re.compile(r'<[^<>\s]+>')
+reply_re = re.compile(r'^\s*(re|aw)\s*:', re.IGNORECASE)
+series_re = re.compile(r'\[[^\]]*?PATCH[^\]]*?(?:\bv(\d+)\b[^\]]*?)?\b(\d+)/(\d+)\s*\]', re.IGNORECASE)
+
+def patch_series(subject, msgid, headers):
+    # (series id, n, m) from [PATCH vX n/m] and the thread root of In-Reply-To/References
+    match = series_re.search(subject)
+    if not match or int(match.group(3)) <= 1:
+        return msgid, 1, 1
+    refs = msgid_re.findall(str(headers['References'] or '')) or msgid_re.findall(str(headers['In-Reply-To'] or ''))
+    # without a cover letter the patches reply to 1/m
+    root = refs[0] if refs else msgid
+    return f"{root} v{match.group(1) or 1} {match.group(3)}", int(match.group(2)), int(match.group(3))
+
+def process_emails(mail, output_dir, state_file='', ledger=None):
+    typ, data = mail.select('INBOX')
+    files = []
+    uidvalidity = int(mail.response('UIDVALIDITY')[1][0] or 0)
+    os.makedirs(output_dir, exist_ok=True)
+    state_file = state_file or os.path.join(output_dir, '.uid_state')
+    last_uid = load_uid_state(state_file, uidvalidity)
+
+    # UID n:* always matches the last message, even below n
+    status, messages = mail.uid('SEARCH', None, f'(UID {last_uid + 1}:* UNSEEN SUBJECT "PATCH")')
+    uids = sorted(uid for uid in map(int, messages[0].split()) if uid > last_uid)
+    if not uids:
+        return files
+
+    for uid, headers, patch_content in fetch_patches(mail, uids):
+        subject = decode_subject(headers['Subject'] or '')
+        if reply_re.match(subject):
+            # a review reply quoting the diff is no patch of the series
+            print(f"skip reply: {subject}")
+            continue
+        patch_content = patch_content.replace('\r\n', '\n')
+        msgid = (headers['Message-ID'] or f"<uid-{uidvalidity}-{uid}>").strip()
+        content_id = patch_id(patch_content)
+        series_id, series_index, series_total = patch_series(subject, msgid, headers)
+        if series_index == 0:
+            # the 0/m cover letter carries no diff
+            continue
+        # a patch of a series may be unchanged in the next version, only whole series are duplicates
+        if ledger and ledger.seen(msgid, content_id if series_total == 1 else ''):
+            print(f"skip patch already handled: {subject} {msgid}")
+            continue
+        filename = generate_filename(subject, output_dir, msgid)
+
+        with open(filename, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(patch_content)
+        print(f"save patch: {filename}")
+        if ledger:
+            ledger.add(msgid, content_id, os.path.abspath(filename), series_id, series_index, series_total)
+
+        files.append(filename)
+
+    # BODY.PEEK leaves the mails unread, mark them read like the RFC822 fetch did
+    for uid_set in uid_sets(uids):
+        mail.uid('STORE', uid_set, '+FLAGS', '(\\Seen)')
+    save_uid_state(state_file, uidvalidity, uids[-1])
+    return files
 
-    for num in messages[0].split():
+def imap_buffered(mail):
+    # a response may already be read into the ssl or imaplib buffers where select can't see it
+    timeout = mail.sock.gettimeout()
+    mail.sock.settimeout(0)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        mail.sock.settimeout(timeout)
+
+def wait_for_mail(mail, timeout):
+    # IMAP IDLE (RFC 2177) until new mail arrives or timeout, imaplib has no IDLE command
+    if 'IDLE' not in mail.capabilities:
+        time.sleep(POLL_INTERVAL)
+        mail.noop()
+        return
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    line = mail.readline()
+    if not line.startswith(b'+'):
+        raise mail.abort(f"IDLE rejected: {line!r}")
+    deadline = time.time() + timeout
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        if not imap_buffered(mail) and not select.select([mail.sock], [], [], remaining)[0]:
+            break
+        line = mail.readline()
+        if not line or line.startswith(b'* BYE'):
+            raise mail.abort(f"connection closed in IDLE: {line!r}")
+        if re.match(rb'\* \d+ (EXISTS|RECENT)', line):
+            break
+    mail.send(b'DONE\r\n')
+    while True:
+        line = mail.readline()
+        if not line:
+            raise mail.abort("connection closed in IDLE")
+        if line.startswith(tag):
+            if not line[len(tag):].strip().startswith(b'OK'):
+                raise mail.error(f"IDLE failed: {line!r}")
+            return
+
+def run_daemon(config, jobs):
+    ledger = open_ledger(config)
+    delay = 1
+    while True:
+        mail = None
         try:
-            typ, msg_data = mail.fetch(num, '(RFC822)')
-            raw_email = msg_data[0][1]
-            msg = email.message_from_bytes(raw_email)
-
-            subject = decode_subject(msg['Subject'])
-
-            patch_content = extract_patch_content(msg)
-            patch_content = patch_content.replace('\r\n', '\n')
-            if patch_content:
-                filename = generate_filename(subject, output_dir)
-
-                with open(filename, 'w', encoding='utf-8', newline='\n') as f:
-                    f.write(patch_content)
-                print(f"save patch: {filename}")
-
-                files.append(filename)
-
-            #    mail.store(num, '+FLAGS', '\\Seen')
-        except Exception as e:
-            print(f"error: {str(e)}")
-    return files
+            mail = connect_mail_server(config)
+            delay = 1
+            while True:
+                patch_list = process_emails(mail, config['output_dir'], config['state_file'], ledger)
+                print(f"Patch list: {patch_list}")
+                try:
+                    run_pending(config, jobs, ledger)
+                except subprocess.CalledProcessError as e:
+                    print(f"Batch failed: {e}")
+                wait_for_mail(mail, IDLE_TIMEOUT)
+        except (imaplib.IMAP4.error, OSError) as e:
+            print(f"IMAP connection lost: {str(e)}, reconnect in {delay}s")
+        if mail is not None:
+            try:
+                mail.shutdown()
+            except OSError:
+                pass
+        time.sleep(delay)
+        delay = min(delay * 2, RECONNECT_MAX)
 
 def decode_subject(encoded_subject):
     subject, encoding = decode_header(encoded_subject)[0]
@@ -95,25 +543,28 @@ def extract_patch_content(msg):
                 return body
     return None
 
-def generate_filename(subject, output_dir):
+def generate_filename(subject, output_dir, msgid=''):
     os.makedirs(output_dir, exist_ok=True)
     safe_subject = subject.replace(':', '_').replace(' ', '_').replace('/', '_')[:50]
+    if msgid:
+        # the subjects of a series are cut to the same 50 characters, the Message-ID tells them apart
+        safe_subject += '_' + hashlib.sha1(msgid.encode('utf-8')).hexdigest()[:8]
     return os.path.join(output_dir, f"{safe_subject}.patch")
 
-def generate_change_id():
+def generate_change_id(worktree):
     # 获取提交信息
-    commit_info = subprocess.check_output(['git', 'log', '-1', '--pretty=%B']).decode('utf-8')
+    commit_info = subprocess.check_output(['git', 'log', '-1', '--pretty=%B'], cwd=worktree).decode('utf-8')
     commit_info = commit_info.strip()
 
     # 获取作者信息
-    author_info = subprocess.check_output(['git', 'log', '-1', '--pretty=%an <%ae>%n%ad']).decode('utf-8')
+    author_info = subprocess.check_output(['git', 'log', '-1', '--pretty=%an <%ae>%n%ad'], cwd=worktree).decode('utf-8')
     author_info = author_info.strip()
 
-    # 获取树对象
-    tree_hash = subprocess.check_output(['git', 'log', '-1', '--pretty=%T']).decode('utf-8').strip()
+    # 获取树对象, the staged tree of the patch so patches on the same base get different Change-Id
+    tree_hash = subprocess.check_output(['git', 'write-tree'], cwd=worktree).decode('utf-8').strip()
 
     # 获取父对象
-    parent_hash = subprocess.check_output(['git', 'log', '-1', '--pretty=%P']).decode('utf-8').strip()
+    parent_hash = subprocess.check_output(['git', 'log', '-1', '--pretty=%P'], cwd=worktree).decode('utf-8').strip()
 
     # 生成 Change-Id
     change_id_input = f"tree {tree_hash}\nparent {parent_hash}\nauthor {author_info}\ncommitter {author_info}\n\n{commit_info}\n"
@@ -121,43 +572,75 @@ def generate_change_id():
     print(f"Change-Id: {change_id}")
     return change_id
 
-def apply_patch(patch_file_path, code_base_dir, branch):
+def fetch_branch(code_base_dir, branch):
+    # one fetch per batch, every patch of the batch is applied on the returned tip
+    subprocess.run(['git', 'fetch', 'origin', branch], cwd=code_base_dir, check=True)
+    return subprocess.check_output(['git', 'rev-parse', 'origin/' + branch + '^{commit}'],
+                                   cwd=code_base_dir).decode('utf-8').strip()
+
+def prepare_worktrees(code_base_dir, worktree_dir, base, count):
+    # detached worktrees, a branch can only be checked out in one worktree
+    subprocess.run(['git', 'worktree', 'prune'], cwd=code_base_dir, check=True)
+    worktrees = []
+    for i in range(count):
+        worktree = os.path.abspath(os.path.join(worktree_dir, f"worker{i}"))
+        if not os.path.exists(os.path.join(worktree, '.git')):
+            subprocess.run(['git', 'worktree', 'add', '--detach', worktree, base],
+                           cwd=code_base_dir, check=True)
+        worktrees.append(worktree)
+    return worktrees
+
+def check_patch(patch_file_path, worktree, base):
+    # git apply --check against a temporary index of base, the worktree is not touched
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(tmp_dir, 'index'))
+        subprocess.run(['git', 'read-tree', base], cwd=worktree, env=env, check=True)
+        result = subprocess.run(['git', 'apply', '--cached', '--check', patch_file_path], cwd=worktree, env=env,
+                                capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"Patch {patch_file_path} does not apply: {result.stderr.strip()}")
+        return False
+    return True
+
+def apply_patch(patch_file_path, worktree, base):
+    # base None stacks the patch on the commits already in the worktree
     try:
-        os.chdir(code_base_dir)
-        subprocess.run(['git', 'checkout', branch], check=True)
-        subprocess.run(['git', 'reset', '--hard', 'origin/' + branch], check=True)
-        subprocess.run(['git', 'pull', 'origin', branch], check=True)
-        subprocess.run(['git', 'apply', patch_file_path], check=True)
+        if not check_patch(patch_file_path, worktree, base or 'HEAD'):
+            return False
+        if base:
+            subprocess.run(['git', 'reset', '--hard', base], cwd=worktree, check=True)
+            subprocess.run(['git', 'clean', '-fd'], cwd=worktree, check=True)
+        subprocess.run(['git', 'apply', patch_file_path], cwd=worktree, check=True)
         print(f"Apply {patch_file_path} susccessfully")
     except subprocess.CalledProcessError as e:
         print(f"Apply failed: {e}")
         return False
     return True
 
-def commit_patch(patch_file_path):
+def commit_patch(patch_file_path, worktree):
     try:
-        change_id = generate_change_id()
-
         with open(patch_file_path, 'r', encoding='utf-8') as f:
             patch_content = f.read()
 
         signofby_txt = [line for line in patch_content.split('\n') if line.startswith('Signed-off-by:')]
         signofby = '\n'.join(signofby_txt)
 
-        subprocess.run(['git', 'add', '.'], check=True)
+        subprocess.run(['git', 'add', '.'], cwd=worktree, check=True)
+        change_id = generate_change_id(worktree)
         commit_message = f"Apply patch {os.path.basename(patch_file_path)}\n\nChange-Id: {change_id}\n{signofby}"
-        subprocess.run(['git', 'commit', '-m', commit_message], check=True)
+        subprocess.run(['git', 'commit', '-m', commit_message], cwd=worktree, check=True)
         print(f"Commit {patch_file_path} susccessfully")
     except subprocess.CalledProcessError as e:
         print(f"Commit Failed: {e}")
         return False
     return True
 
-def push_to_gerrit(gerrit_url, gerrit_branch):
+def push_to_gerrit(gerrit_url, gerrit_branch, worktree):
     try:
         gerrit_branch = gerrit_branch.strip("'\"")
         push_target = f'HEAD:refs/for/{gerrit_branch}'
-        result = subprocess.run(['git', 'push', gerrit_url, push_target], check=True, capture_output=True, text=True)
+        result = subprocess.run(['git', 'push', gerrit_url, push_target], cwd=worktree,
+                                check=True, capture_output=True, text=True)
         print("Push Gerrit susccessfully ")
         #print("result info:", result)
         return result.returncode, result.stderr
@@ -165,41 +648,156 @@ def push_to_gerrit(gerrit_url, gerrit_branch):
         print(f"Push Gerrit failed: {e}")
         return None
 
-def set_verified_score(change_id, gerrit_url, gerrit_username, gerrit_password):
-    print(f"Set verified score for {change_id}")
-    gerrit = Gerrit(gerrit_url, gerrit_username, gerrit_password)
-    message  = "Auto Verified by AMLRobot"
-    response = gerrit.post_review_pass_message(change_id, message)
-    print(response)
-
-def extract_change_id(push_output):
-    match = re.search(r'https://scgit\.amlogic\.com/(\d+)', push_output)
-    if match:
-        return match.group(1)
-    return None
+def get_gerrit(gerrit_url, gerrit_username, gerrit_password):
+    global gerrit_client
+    with gerrit_lock:
+        if gerrit_client is None:
+            gerrit_client = Gerrit(gerrit_url, gerrit_username, gerrit_password, pool_size=jobs)
+    return gerrit_client
+
+def verify_changes(change_ids, config):
+    # the current revisions of the whole batch in one query, then the review posts concurrently
+    try:
+        gerrit = get_gerrit(config['gerrit_http_url'].strip("'\""),
+                            config['gerrit_username'].strip("'\""),
+                            config['gerrit_password'].strip("'\""))
+        async_gerrit = AsyncGerrit(gerrit, jobs)
+        try:
+            responses = asyncio.run(async_gerrit.post_review_pass_messages(change_ids, VERIFY_MESSAGE))
+        finally:
+            async_gerrit.close()
+        for change_id, response in zip(change_ids, responses):
+            print(f"Set verified score for {change_id}")
+            print(response)
+        return [change_id for change_id, response in zip(change_ids, responses) if isinstance(response, dict)]
+    except Exception as e:
+        print(f"Verify failed: {str(e)}")
+        return []
+
+def extract_change_ids(push_output):
+    # one change per pushed commit, in the order gerrit lists them
+    return list(dict.fromkeys(re.findall(r'https://scgit\.amlogic\.com/(\d+)', push_output)))
+
+def fail_series(series, ledger, failed_path, error):
+    if ledger:
+        for patch_path in series:
+            ledger.update(patch_path, 'failed', error=error if patch_path == failed_path else 'series')
+
+def process_series(series, worktree, base, config, push_lock, ledger=None):
+    # resume from the stages the ledger has for the patches of the series
+    states = [(ledger.get(patch_path) if ledger else None) or ('saved', None, None) for patch_path in series]
+    if all(state[0] == 'pushed' for state in states):
+        return [state[2] for state in states]
+    if all(state[0] == 'committed' for state in states) and states[-1][1]:
+        # push the commits made before, with the same Change-Id
+        subprocess.run(['git', 'reset', '--hard', states[-1][1]], cwd=worktree, check=True)
+    else:
+        # git am style: every patch stacked on the previous one, the first on base
+        for i, patch_path in enumerate(series):
+            if not apply_patch(patch_path, worktree, base if i == 0 else None):
+                fail_series(series, ledger, patch_path, 'apply')
+                return []
+            if ledger:
+                ledger.update(patch_path, 'applied')
+            if not commit_patch(patch_path, worktree):
+                fail_series(series, ledger, patch_path, 'commit')
+                return []
+            commit_sha = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=worktree).decode('utf-8').strip()
+            if ledger:
+                ledger.update(patch_path, 'committed', commit_sha=commit_sha)
+    push_url = config['gerrit_url'].strip("'\"") + config['gerrit_prj'].strip("'\"")
+    # apply and commit run in parallel, only the push to gerrit is serialized, one push per series
+    with push_lock:
+        pushed = push_to_gerrit(push_url, config['gerrit_branch'], worktree)
+    if pushed is None or pushed[0] != 0:
+        # stays committed, the push is tried again with the next batch
+        return []
+    change_ids = extract_change_ids(pushed[1])
+    if len(change_ids) != len(series):
+        print(f"{len(change_ids)} changes in the push output of {len(series)} patches: {series[0]}")
+        fail_series(series, ledger, None, 'push output')
+        return change_ids
+    if ledger:
+        for patch_path, change_id in zip(series, change_ids):
+            ledger.update(patch_path, 'pushed', change_id=change_id)
+    return change_ids
+
+def process_series_in_worktree(series, worktrees, base, config, push_lock, ledger):
+    # borrow an idle worktree, one series at a time per worktree
+    worktree = worktrees.get()
+    try:
+        return process_series(series, worktree, base, config, push_lock, ledger)
+    except Exception as e:
+        print(f"Error: {series[0]}: {str(e)}")
+        return []
+    finally:
+        worktrees.put(worktree)
+
+def run_batch(series_list, config, jobs, ledger=None):
+    # series_list: the patch files of every series in n/m order, a single patch is a series of one
+    branch = config['gerrit_branch'].strip("'\"")
+    base = fetch_branch(config['code_base_dir'], branch)
+    print(f"Apply on {branch} {base}")
+    worktrees = queue.Queue()
+    for worktree in prepare_worktrees(config['code_base_dir'], config['worktree_dir'], base,
+                                      min(jobs, len(series_list))):
+        worktrees.put(worktree)
+    push_lock = threading.Lock()
+    with ThreadPoolExecutor(jobs) as pool:
+        futures = [pool.submit(process_series_in_worktree, series, worktrees, base, config, push_lock, ledger)
+                   for series in series_list]
+        change_ids = [change_id for future in futures for change_id in future.result()]
+    change_ids = [change_id for change_id in change_ids if change_id]
+    if change_ids:
+        verified = verify_changes(change_ids, config)
+        if ledger:
+            ledger.verified(verified)
+
+def open_ledger(config):
+    return PatchLedger(config['ledger_file'] or os.path.join(config['output_dir'], 'ledger.db'))
+
+def run_pending(config, jobs, ledger):
+    # the new patches and the ones a previous run left unfinished
+    pending = ledger.unfinished()
+    if pending:
+        run_batch(pending, config, jobs, ledger)
 
 if __name__ == "__main__":
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "c:j:dt:hv", ["help", "version"])
+    except getopt.GetoptError as err:
+        print(err)
+        print(usage.__doc__)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage.__doc__)
+            sys.exit()
+        elif opt in ("-c",):
+            CONFIG_FILE = arg
+        elif opt in ("-j",):
+            jobs = max(int(arg), 1)
+        elif opt in ("-d",):
+            daemon = True
+        elif opt in ("-t",):
+            POLL_INTERVAL = max(int(arg), 1)
+        elif opt in ("-v", "--version"):
+            print(VERSION)
+            sys.exit()
+
     try:
         config = load_config()
+        if daemon:
+            run_daemon(config, jobs)
+        ledger = open_ledger(config)
         mail = connect_mail_server(config)
-        patch_list = process_emails(mail, config['output_dir'])
+        patch_list = process_emails(mail, config['output_dir'], config['state_file'], ledger)
         mail.close()
         mail.logout()
         print(f"Patch list: {patch_list}")
-        current_dir = os.path.dirname(os.path.abspath(__file__))
 
         #patch_list = ['patches/[PATCH_1_1]_For_test_robot_jenkins.patch']
-        for patch in patch_list:
-            patch_path = os.path.join(current_dir, patch)
-            if apply_patch(patch_path, config['code_base_dir'], config['gerrit_branch'].strip("'\"")):
-                if commit_patch(patch_path):
-                    push_url = config['gerrit_url'].strip("'\"") + config['gerrit_prj'].strip("'\"")
-                    retval, cl_link = push_to_gerrit(push_url, config['gerrit_branch'])
-                    if retval == 0:
-                        set_verified_score(extract_change_id(cl_link),
-                                           config['gerrit_http_url'].strip("'\""),
-                                           config['gerrit_username'].strip("'\""),
-                                           config['gerrit_password'].strip("'\""))
+        run_pending(config, jobs, ledger)
 
     except Exception as e:
         print(f"Error: {str(e)}")
\ No newline at end of file
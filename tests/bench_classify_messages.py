@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+# time classify_messages of parse_lore_kernel.py against the list scans it replaced,
+# the old quadratic loops only run on a subset
+# Usage: ./bench_classify_messages.py [-n messages] [-b baseline messages]
+
+import sys
+import time
+import getopt
+
+import scripts
+import lore_stand_in
+
+lore = scripts.load("parse_lore_kernel/parse_lore_kernel.py")
+
+def list_classify(total_list):
+	#the dedupe and the reply/submission matching before classify_messages
+	title_only_list = []
+	new_total_list = []
+	submission_list = []
+	replay_list = []
+	review_list = []
+	for info in total_list:
+		if info[0] not in title_only_list:
+			title_only_list.append(info[0])
+			new_total_list.append(info)
+
+	for info in new_total_list:
+		if "Re: " in info[0]:
+			replay_list.append(info)
+		else:
+			submission_list.append(info)
+
+	for info1 in replay_list:
+		flag = 0
+		for info2 in submission_list:
+			if info2[0] in info1[0]:
+				flag = 1
+				break;
+		if (flag == 0): #replay is not in submission list
+			review_list.append(info1)
+	return new_total_list, submission_list, replay_list, review_list
+
+def make_list(count):
+	#the [PATCH messages of the stand-in as the fetch gives them
+	return [lore.Message(msg["subject"], "https://lore.kernel.org/all/" + msg["msgid"], msg["author"],
+		msg["date"].strftime("%Y-%m-%d %H:%M UTC"), msg["msgid"], msg["refs"])
+		for msg in lore_stand_in.make_messages(count) if "[PATCH" in msg["subject"]]
+
+def timed(name, func, total_list):
+	start = time.time()
+	lists = func(total_list)
+	print("%-22s %6d messages %7.3fs  total/submission/reply/review %s" % (name, len(total_list),
+		time.time() - start, "/".join(str(len(name_list)) for name_list in lists)))
+	return lists
+
+if __name__ == '__main__':
+	count = 100000
+	baseline = 5000
+	opts, args = getopt.getopt(sys.argv[1:], "n:b:")
+	for opt, arg in opts:
+		if opt == "-n":
+			count = int(arg)
+		elif opt == "-b":
+			baseline = int(arg)
+
+	total_list = make_list(count)
+	subset = total_list[:baseline]
+	timed("list scans", list_classify, subset)
+	timed("classify_messages", lore.classify_messages, subset)
+	timed("classify_messages", lore.classify_messages, total_list)
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+# time the dates of parse_git_message.py: the strptime/strftime of before against
+# format_date and signature_date, alone and per commit in parse_records of a generated log
+# Usage: ./bench_format_date.py [-n commits]
+
+import io
+import sys
+import time
+import random
+import getopt
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+import scripts
+
+parse = scripts.load("parse_git_msg/parse_git_message.py")
+
+Signature = namedtuple("Signature", "time offset")
+
+def strptime_format_date(date_str):
+	#format_date before the fast path
+	datetime_obj = datetime.strptime(date_str, "%a %b %d %H:%M:%S %Y %z")
+	return datetime_obj.strftime("%Y-%m-%d %H:%M:%S")
+
+def datetime_signature_date(signature):
+	#signature_date before the fast path
+	tz = timezone(timedelta(minutes=signature.offset))
+	return datetime.fromtimestamp(signature.time, tz).strftime("%Y-%m-%d %H:%M:%S")
+
+def make_dates(count, seed=1):
+	#(epoch, offset in minutes, %ad text, %aI text) of count commits
+	rand = random.Random(seed)
+	dates = []
+	for _ in range(count):
+		stamp = rand.randint(1262304000, 1735689600)
+		offset = rand.choice([-480, -420, 0, 60, 330, 480, 540])
+		local = datetime.fromtimestamp(stamp, timezone(timedelta(minutes=offset)))
+		text = local.strftime("%a %b ") + str(local.day) + local.strftime(" %H:%M:%S %Y %z")
+		dates.append((stamp, offset, text, local.isoformat()))
+	return dates
+
+def make_log(dates, iso):
+	#the record format of LOG_FORMAT with the dates of %aI, or %ad as before
+	out = io.StringIO()
+	for i, (stamp, offset, text, iso_text) in enumerate(dates):
+		date_str = iso_text if iso else text
+		out.write(parse.RECORD_SEP + parse.FIELD_SEP.join(["%040x" % i, "Dev <dev@amlogic.com>", date_str, date_str,
+			"soc: change %d" % i, "Link: https://lore.kernel.org/r/%d@b.c\n" % i, ""]) + "\n\n3\t1\tdrivers/soc/f.c\n")
+	return out.getvalue()
+
+def timed(name, func, *args):
+	start = time.time()
+	result = func(*args)
+	print("%-34s %7.3fs" % (name, time.time() - start))
+	return result
+
+def parse_log(log, format_date):
+	saved = parse.format_date
+	parse.format_date = format_date
+	try:
+		return list(parse.parse_records(parse.split_records(io.StringIO(log))))
+	finally:
+		parse.format_date = saved
+
+if __name__ == '__main__':
+	count = 100000
+	opts, args = getopt.getopt(sys.argv[1:], "n:")
+	for opt, arg in opts:
+		if opt == "-n":
+			count = int(arg)
+
+	dates = make_dates(count)
+	texts = [date[2] for date in dates]
+	iso_texts = [date[3] for date in dates]
+	signatures = [Signature(date[0], date[1]) for date in dates]
+	print("%d dates" % count)
+	old = timed("strptime + strftime", lambda: [strptime_format_date(t) for t in texts])
+	new = timed("format_date %ad", lambda: [parse.format_date(t) for t in texts])
+	iso = timed("format_date %aI", lambda: [parse.format_date(t) for t in iso_texts])
+	old_sig = timed("datetime signature_date", lambda: [datetime_signature_date(s) for s in signatures])
+	new_sig = timed("gmtime signature_date", lambda: [parse.signature_date(s) for s in signatures])
+	print("same dates:", old == new == iso == old_sig == new_sig)
+
+	old_records = timed("parse_records %ad + strptime", parse_log, make_log(dates, False), strptime_format_date)
+	new_records = timed("parse_records %aI + format_date", parse_log, make_log(dates, True), parse.format_date)
+	print("same records:", old_records == new_records)
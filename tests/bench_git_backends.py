@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+# time the git log and pygit2 backends of parse_git_message.py on a synthetic history
+# and check that they give the same commits
+# Usage: ./bench_git_backends.py [-n commits] [-j jobs] [-s since]
+
+import os
+import sys
+import time
+import random
+import getopt
+import shutil
+import tempfile
+import subprocess
+
+import scripts
+
+parse = scripts.load("parse_git_msg/parse_git_message.py")
+
+AUTHORS = ["Dev One <dev1@amlogic.com>", "Dev Two <dev2@amlogic.com>", "Other <other@example.com>",
+	"Third <third@example.org>"]
+ZONES = ["+0800", "-0700", "+0000", "+0530"]
+DIRS = ["drivers/soc", "drivers/gpu", "arch/arm64/boot/dts", "sound/soc", "Documentation"]
+
+def fast_import_stream(count, seed=1):
+	"""
+	fast-import commands of count commits from 2015 on: 1 to 3 changed files
+	per commit, renames, top-level files, a Linus release commit every 500
+	and committer dates that go back now and then.
+	"""
+	rand = random.Random(seed)
+	files = {}
+	stamp = 1420070400
+	out = []
+	for mark in range(1, count + 1):
+		stamp += rand.randint(600, 2 * 86400 * 3000 // max(count, 1))
+		commit_stamp = stamp + rand.randint(-3 * 86400, 86400)
+		zone = rand.choice(ZONES)
+		changes = []
+		if mark % 500 == 0:
+			who = "Linus Torvalds <torvalds@linux-foundation.org>"
+			message = "Linux 6.%d\n" % (mark // 500)
+			paths = ["Makefile"]
+		else:
+			who = rand.choice(AUTHORS)
+			message = "%s: change %d\n\nSome words.\n\nLink: https://lore.kernel.org/r/%d@b.c\n" % (
+				rand.choice(DIRS), mark, mark)
+			paths = ["%s/f%d.c" % (rand.choice(DIRS), rand.randint(0, 40)) for _ in range(rand.randint(1, 3))]
+			if rand.random() < 0.05:
+				paths.append(rand.choice(["MAINTAINERS", "README"]))
+			if files and rand.random() < 0.02:
+				old = rand.choice(sorted(path for path in files if "/" in path))
+				new = os.path.dirname(old) + "/renamed%d.c" % mark
+				changes.append("R %s %s\n" % (old, new))
+				files[new] = files.pop(old)
+		for path in dict.fromkeys(paths):
+			lines = files.setdefault(path, [])
+			del lines[:rand.randint(0, min(2, len(lines)))]
+			lines.extend("line %d %d\n" % (mark, i) for i in range(rand.randint(1, 20)))
+			content = "".join(lines).encode()
+			changes.append("M 100644 inline %s\ndata %d\n" % (path, len(content)) + content.decode() + "\n")
+		message = message.encode()
+		out.append("commit refs/heads/master\nmark :%d\nauthor %s %d %s\ncommitter %s %d %s\ndata %d\n" % (
+			mark, who, stamp, zone, who, commit_stamp, zone, len(message)) + message.decode() + "\n")
+		if mark > 1:
+			out.append("from :%d\n" % (mark - 1))
+		out.extend(changes)
+		out.append("\n")
+	return "".join(out)
+
+def make_repo(root, count):
+	subprocess.run(["git", "init", "-q", "-b", "master", root], check=True)
+	subprocess.run(["git", "fast-import", "--quiet"], cwd=root, input=fast_import_stream(count).encode(), check=True)
+	subprocess.run(["git", "reset", "-q", "--hard"], cwd=root, check=True)
+
+def timed(name, func):
+	start = time.time()
+	records = list(func())
+	seconds = time.time() - start
+	print("%-10s %6d commits %7.2fs %8.0f commits/s" % (name, len(records), seconds, len(records) / seconds))
+	return records
+
+if __name__ == '__main__':
+	count = 20000
+	jobs = 4
+	since = "2017"
+	opts, args = getopt.getopt(sys.argv[1:], "n:j:s:")
+	for opt, arg in opts:
+		if opt == "-n":
+			count = int(arg)
+		elif opt == "-j":
+			jobs = int(arg)
+		elif opt == "-s":
+			since = arg
+
+	root = tempfile.mkdtemp()
+	try:
+		start = time.time()
+		make_repo(root, count)
+		print("synthetic history of %d commits in %.1fs" % (count, time.time() - start))
+		os.chdir(root)
+		author = "amlogic.com"
+		results = {"git": timed("git", lambda: parse.read_git_log(parse.git_log_cmd(author, since)))}
+		results["git -j"] = timed("git -j%d" % jobs, lambda: parse.read_git_log_jobs(author, since, jobs))
+		if parse.pygit2 is None:
+			print("pygit2 is not installed, skip the pygit2 backend")
+		else:
+			results["pygit2"] = timed("pygit2", lambda: parse.read_pygit2_log(author, since))
+		for name, records in results.items():
+			print("%-10s same commits as git log: %s" % (name, records == results["git"]))
+	finally:
+		os.chdir("/")
+		shutil.rmtree(root)
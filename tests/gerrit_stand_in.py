@@ -0,0 +1,223 @@
+# -*- coding: UTF-8 -*-
+# gerrit stand-ins for robot-jenkins.py: a bare repo with refs/for hooks for the git push
+# and a gerrit 2.16 REST server over TLS with cookie login and the )]}' prefix
+
+import os
+import ssl
+import json
+import time
+import secrets
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# the refs/for magic branch: one change per new commit, the ref itself is not kept
+POST_RECEIVE = """#!/bin/sh
+while read old new ref; do
+  case $ref in refs/for/*)
+    for commit in $(git rev-list --reverse $new --not --branches); do
+      echo "$commit $(git rev-parse $commit~1) $(git log -1 --format=%s $commit)" >> changes.log
+      echo "remote:   https://scgit.amlogic.com/$((1000 + $(wc -l < changes.log))) $(git log -1 --format=%s $commit)" >&2
+    done
+    git update-ref -d $ref;;
+  esac
+done
+"""
+
+# the pushes with a subject matching the pattern in reject_push are refused
+PRE_RECEIVE = """#!/bin/sh
+[ -f reject_push ] || exit 0
+while read old new ref; do
+  if git log --format=%s $new --not --branches | grep -q "$(cat reject_push)"; then
+    echo "rejected by the stand-in" >&2
+    exit 1
+  fi
+done
+"""
+
+def git(cwd, *args):
+    env = dict(os.environ, GIT_AUTHOR_NAME="A", GIT_AUTHOR_EMAIL="a@b.c",
+               GIT_COMMITTER_NAME="A", GIT_COMMITTER_EMAIL="a@b.c")
+    return subprocess.run(["git"] + list(args), cwd=cwd, env=env, check=True,
+                          capture_output=True, text=True).stdout
+
+def make_remote(root, files=8, branch="dev"):
+    """
+    root/gerrit.git with branch holding files f1.txt..fN.txt, root/src to make
+    the patches in and root/clone as CODE_BASE_DIR. The branch moves after the
+    clone, so the robot has to fetch it.
+    """
+    remote = os.path.join(root, "gerrit.git")
+    src = os.path.join(root, "src")
+    clone = os.path.join(root, "clone")
+    git(root, "init", "-q", "--bare", "-b", branch, remote)
+    for name, script in (("post-receive", POST_RECEIVE), ("pre-receive", PRE_RECEIVE)):
+        path = os.path.join(remote, "hooks", name)
+        with open(path, "w") as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+    git(root, "init", "-q", "-b", branch, src)
+    for i in range(1, files + 1):
+        with open(os.path.join(src, "f%d.txt" % i), "w") as f:
+            f.write("base\n")
+    git(src, "add", ".")
+    git(src, "commit", "-qm", "base")
+    git(src, "push", "-q", remote, branch)
+    git(root, "clone", "-q", remote, clone)
+    git(clone, "config", "user.email", "robot@b.c")
+    git(clone, "config", "user.name", "Robot")
+    with open(os.path.join(src, "moved.txt"), "w") as f:
+        f.write("upstream moved\n")
+    git(src, "add", "moved.txt")
+    git(src, "commit", "-qm", "upstream moved")
+    git(src, "push", "-q", remote, branch)
+    return remote, src, clone
+
+def format_patches(src, changes, base="HEAD~1", branch="dev", cover=False):
+    """
+    Commit the (file, line) changes on top of base one after the other and
+    return the mails of git format-patch as CRLF bytes, [PATCH n/m] numbered
+    when there are several.
+    """
+    git(src, "checkout", "-q", "--detach", base)
+    for name, line in changes:
+        with open(os.path.join(src, name), "a") as f:
+            f.write(line + "\n")
+        git(src, "add", name)
+        git(src, "commit", "-qm", "%s: %s\n\nSigned-off-by: A <a@b.c>" % (name, line))
+    args = ["format-patch", "--stdout", "--thread=shallow", "-%d" % len(changes)]
+    if len(changes) > 1:
+        args.append("--numbered")
+    if cover:
+        args.append("--cover-letter")
+    mbox = git(src, *args)
+    git(src, "checkout", "-q", branch)
+    mails = []
+    for mail in mbox.split("\nFrom "):
+        # drop the "From <sha> Mon Sep 17 00:00:00 2001" line of the mbox
+        mail = mail.split("\n", 1)[1]
+        mails.append(mail.replace("\n", "\r\n").encode())
+    return mails
+
+def pushed_changes(remote):
+    # (commit, parent, subject) of every change made by the pushes, in order
+    path = os.path.join(remote, "changes.log")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [tuple(line.rstrip("\n").split(" ", 2)) for line in f]
+
+class Gerrit:
+    """
+    State of the REST stand-in: the logged in sessions, the posted reviews,
+    the current revision of every change and the request log. delay slows
+    down every REST call, expire_sessions() makes the next calls fail with
+    403 until the client logs in again.
+    """
+    def __init__(self, delay=0.0):
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.reviews = []
+        self.revisions = {}
+        self.requests = []
+        self.logins = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self.delay = delay
+
+    def expire_sessions(self):
+        with self.lock:
+            self.sessions.clear()
+
+    def revision(self, number):
+        with self.lock:
+            return self.revisions.setdefault(str(number), "%040x" % (int(number) * 7919))
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    gerrit = None
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, obj=None, headers=()):
+        body = b"" if obj is None else (")]}'\n" + json.dumps(obj)).encode()
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        cookies = dict(p.strip().split("=", 1) for p in self.headers.get("Cookie", "").split(";") if "=" in p)
+        with self.gerrit.lock:
+            logged_in = cookies.get("GerritAccount") in self.gerrit.sessions
+        return logged_in and self.headers.get("x-gerrit-auth") == cookies.get("XSRF_TOKEN")
+
+    def handle_method(self, method):
+        gerrit = self.gerrit
+        with gerrit.lock:
+            gerrit.requests.append(method + " " + self.path)
+            gerrit.inflight += 1
+            gerrit.max_inflight = max(gerrit.max_inflight, gerrit.inflight)
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            data = self.rfile.read(length) if length else b""
+            url = urlparse(self.path)
+            if url.path == "/login/":
+                if method == "GET":
+                    return self.reply(200, {})
+                account, xsrf = secrets.token_hex(8), secrets.token_hex(8)
+                with gerrit.lock:
+                    gerrit.sessions.add(account)
+                    gerrit.logins += 1
+                return self.reply(200, {}, [("Set-Cookie", "GerritAccount=%s; Path=/" % account),
+                                            ("Set-Cookie", "XSRF_TOKEN=%s; Path=/" % xsrf)])
+            if not self.authorized():
+                return self.reply(403)
+            time.sleep(gerrit.delay)
+            parts = url.path.split("/")
+            if url.path in ("/a/changes/", "/a/changes"):
+                # change:N OR change:M ... per q, a list of lists for several q
+                results = []
+                for query in parse_qs(url.query).get("q", []):
+                    numbers = [t.split(":")[1] for t in query.replace("+", " ").split() if t.startswith("change:")]
+                    results.append([{"_number": int(n), "current_revision": gerrit.revision(n), "status": "NEW"}
+                                    for n in numbers])
+                return self.reply(200, results[0] if len(results) == 1 else results)
+            if len(parts) == 4 and method == "GET":
+                return self.reply(200, {"_number": int(parts[3]), "current_revision": gerrit.revision(parts[3])})
+            if len(parts) == 5 and parts[4] == "detail":
+                return self.reply(200, {"messages": [{"_revision_number": 1}]})
+            if len(parts) == 7 and parts[6] == "review":
+                if method == "GET":
+                    return self.reply(200, {"current_revision": gerrit.revision(parts[3])})
+                with gerrit.lock:
+                    gerrit.reviews.append((parts[3], parts[5], json.loads(data)))
+                return self.reply(200, {"labels": {"Verified": 2}})
+            return self.reply(404)
+        finally:
+            with gerrit.lock:
+                gerrit.inflight -= 1
+
+    def do_GET(self):
+        self.handle_method("GET")
+
+    def do_POST(self):
+        self.handle_method("POST")
+
+    def do_PUT(self):
+        self.handle_method("PUT")
+
+def start(gerrit, certfile, port=0):
+    # serve gerrit on 127.0.0.1 over TLS, the port is server.server_address[1]
+    handler = type("GerritHandler", (Handler,), {"gerrit": gerrit})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,230 @@
+# -*- coding: UTF-8 -*-
+# IMAP4rev1 stand-in over TLS for robot-jenkins.py: LOGIN SELECT UID SEARCH/FETCH/STORE
+# with BODYSTRUCTURE and BODY.PEEK sections, NOOP, IDLE, CLOSE and LOGOUT of one INBOX
+
+import re
+import ssl
+import email
+import socket
+import threading
+
+class Mailbox:
+    """
+    The messages of the INBOX as dicts of uid, raw and seen. add() wakes up
+    the clients in IDLE, drop_clients() cuts every connection like a server
+    restart. stats counts the logins, the commands and the fetched bytes.
+    """
+    def __init__(self, idle=True):
+        self.cond = threading.Condition()
+        self.messages = []
+        self.capabilities = ["IMAP4rev1"] + (["IDLE"] if idle else [])
+        self.uidvalidity = 1
+        self.clients = []
+        self.stats = {"logins": 0, "commands": [], "fetched_bytes": 0}
+
+    def add(self, raw):
+        with self.cond:
+            uid = (self.messages[-1]["uid"] + 1) if self.messages else 1
+            self.messages.append(dict(uid=uid, raw=raw, seen=False))
+            self.cond.notify_all()
+        return uid
+
+    def drop_clients(self):
+        for sock in list(self.clients):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def uids(self, spec):
+        with self.cond:
+            all_uids = [m["uid"] for m in self.messages]
+        found = set()
+        for part in spec.split(","):
+            low, _, high = part.partition(":")
+            low = int(low)
+            if high == "*":
+                # n:* always takes in the last message, even below n
+                high = all_uids[-1] if all_uids else 0
+                low, high = min(low, high), max(low, high)
+            else:
+                high = int(high or low)
+            found |= set(uid for uid in all_uids if low <= uid <= high)
+        return sorted(found)
+
+    def message(self, uid):
+        with self.cond:
+            return next((i, m) for i, m in enumerate(self.messages) if m["uid"] == uid)
+
+def quote(value):
+    return "NIL" if value is None else '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def bodystructure(part):
+    if part.is_multipart():
+        return "(" + "".join(bodystructure(p) for p in part.get_payload()) + " " + \
+            quote(part.get_content_subtype().upper()) + ")"
+    params = part.get_params()[1:] if part.get_params() else []
+    plist = "(" + " ".join(quote(k.upper()) + " " + quote(v) for k, v in params) + ")" if params else "NIL"
+    payload = part.get_payload(decode=False).encode()
+    encoding = part.get("Content-Transfer-Encoding", "7bit")
+    if part.get("Content-Disposition"):
+        dparams = part.get_params(header="content-disposition")[1:]
+        disposition = "(" + quote(part.get_content_disposition()) + " " + \
+            ("(" + " ".join(quote(k) + " " + quote(v) for k, v in dparams) + ")" if dparams else "NIL") + ")"
+    else:
+        disposition = "NIL"
+    fields = [quote(part.get_content_maintype().upper()), quote(part.get_content_subtype().upper()), plist,
+              "NIL", "NIL", quote(encoding.upper()), str(len(payload))]
+    if part.get_content_maintype() == "text":
+        fields.append(str(payload.count(b"\n")))
+    return "(" + " ".join(fields) + " NIL " + disposition + " NIL NIL)"
+
+def section(raw, name):
+    msg = email.message_from_bytes(raw)
+    if name == "":
+        return raw
+    if name.startswith("HEADER.FIELDS"):
+        names = name[name.index("(") + 1:name.index(")")].split()
+        return ("".join("%s: %s\r\n" % item for item in msg.items() if item[0].upper() in names) + "\r\n").encode()
+    if not msg.is_multipart():
+        return raw.partition(b"\r\n\r\n")[2]
+    part = msg
+    for number in name.split("."):
+        part = part.get_payload()[int(number) - 1]
+    return part.get_payload(decode=False).encode()
+
+class Connection:
+    def __init__(self, mailbox, sock):
+        self.mailbox = mailbox
+        self.sock = sock
+        self.file = sock.makefile("rb")
+        # the message count last told to the client
+        self.exists = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.sock.sendall(data)
+
+    def run(self):
+        self.write("* OK stand-in ready\r\n")
+        while True:
+            line = self.file.readline()
+            if not line:
+                return
+            tag, _, rest = line.rstrip(b"\r\n").decode().partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            self.mailbox.stats["commands"].append(command if command != "UID" else "UID " + args.split()[0].upper())
+            handler = getattr(self, "do_" + command, None)
+            if handler is None:
+                self.write(f"{tag} BAD unknown command\r\n")
+            elif handler(tag, args) == "quit":
+                return
+
+    def do_CAPABILITY(self, tag, args):
+        self.write("* CAPABILITY " + " ".join(self.mailbox.capabilities) + f"\r\n{tag} OK done\r\n")
+
+    def do_LOGIN(self, tag, args):
+        self.mailbox.stats["logins"] += 1
+        self.write(f"{tag} OK logged in\r\n")
+
+    def do_SELECT(self, tag, args):
+        with self.mailbox.cond:
+            count = len(self.mailbox.messages)
+        self.exists = count
+        self.write(f"* {count} EXISTS\r\n* 0 RECENT\r\n* OK [UIDVALIDITY {self.mailbox.uidvalidity}] ok\r\n"
+                   f"{tag} OK [READ-WRITE] done\r\n")
+
+    def do_NOOP(self, tag, args):
+        self.write(f"{tag} OK done\r\n")
+
+    do_CLOSE = do_NOOP
+
+    def do_LOGOUT(self, tag, args):
+        self.write(f"* BYE\r\n{tag} OK done\r\n")
+        return "quit"
+
+    def do_UID(self, tag, args):
+        command, _, rest = args.partition(" ")
+        command = command.upper()
+        if command == "SEARCH":
+            # only UNSEEN SUBJECT "PATCH" is searched for
+            match = re.search(r"UID (\S+)", rest)
+            uids = self.mailbox.uids(match.group(1) if match else "1:*")
+            with self.mailbox.cond:
+                found = [str(m["uid"]) for m in self.mailbox.messages if m["uid"] in uids and not m["seen"]
+                         and b"PATCH" in m["raw"].split(b"\r\n\r\n")[0]]
+            self.write("* SEARCH " + " ".join(found) + f"\r\n{tag} OK done\r\n")
+        elif command == "STORE":
+            for uid in self.mailbox.uids(rest.split()[0]):
+                self.mailbox.message(uid)[1]["seen"] = True
+            self.write(f"{tag} OK done\r\n")
+        elif command == "FETCH":
+            spec, _, items = rest.partition(" ")
+            sections = re.findall(r"BODY\.PEEK\[([^\]]*)\]", items)
+            out = b""
+            for uid in self.mailbox.uids(spec):
+                index, message = self.mailbox.message(uid)
+                parts = [b"UID %d" % uid]
+                if "BODYSTRUCTURE" in items.upper():
+                    structure = bodystructure(email.message_from_bytes(message["raw"]))
+                    parts.append(b"BODYSTRUCTURE " + structure.encode())
+                for name in sections:
+                    data = section(message["raw"], name)
+                    self.mailbox.stats["fetched_bytes"] += len(data)
+                    parts.append(b"BODY[%s] {%d}\r\n" % (name.encode(), len(data)) + data)
+                out += b"* %d FETCH (" % (index + 1) + b" ".join(parts) + b")\r\n"
+            self.write(out + f"{tag} OK done\r\n".encode())
+        else:
+            self.write(f"{tag} BAD unknown command\r\n")
+
+    def do_IDLE(self, tag, args):
+        self.write("+ idling\r\n")
+        done = threading.Event()
+        def read_done():
+            self.file.readline()
+            done.set()
+            with self.mailbox.cond:
+                self.mailbox.cond.notify_all()
+        reader = threading.Thread(target=read_done, daemon=True)
+        reader.start()
+        while not done.is_set():
+            # the mails that came in since the client was told last are reported at once
+            with self.mailbox.cond:
+                count = len(self.mailbox.messages)
+                if count == self.exists:
+                    self.mailbox.cond.wait(0.2)
+                    count = len(self.mailbox.messages)
+            if count > self.exists and not done.is_set():
+                self.write(f"* {count} EXISTS\r\n")
+                self.exists = count
+        reader.join()
+        self.write(f"{tag} OK IDLE terminated\r\n")
+
+def start(mailbox, certfile, port=0):
+    # serve the mailbox on 127.0.0.1, returns the listening socket, the port is getsockname()[1]
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile)
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", port))
+    listener.listen(8)
+    def handle(sock):
+        try:
+            tls = context.wrap_socket(sock, server_side=True)
+            mailbox.clients.append(tls)
+            Connection(mailbox, tls).run()
+        except (OSError, ValueError, IndexError, StopIteration):
+            pass
+        finally:
+            sock.close()
+    def serve():
+        while True:
+            try:
+                sock, _ = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=handle, args=(sock,), daemon=True).start()
+    threading.Thread(target=serve, daemon=True).start()
+    return listener
@@ -0,0 +1,210 @@
+# -*- coding: UTF-8 -*-
+# lore.kernel.org stand-in for parse_lore_kernel.py over plain http: the /all/?q=
+# result pages in the public-inbox layout, 200 results per page, and the x=m mbox.gz
+
+import gzip
+import html
+import time
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, quote
+
+PAGE_SIZE = 200
+
+PAGE_HEAD = """<html><head><title>%(q)s - search results</title><link
+rel=alternate
+title="Atom feed"
+href="?q=%(qq)s&amp;x=A"
+type="application/atom+xml"/><style>pre{white-space:pre-wrap}*{font-size:100%%;font-family:monospace}</style></head><body><form
+action="./"><pre><a
+href="../../">all lists</a> <a href="./">search</a> <a href="_/text/help/">help</a> / <a href="_/text/color/">color</a> / <a id=mirror href="_/text/mirror/">mirror</a> / <a id=atom href="?q=%(qq)s&amp;x=A">Atom feed</a>
+<input name=q value="%(q)s" type=text /><input type=submit value="search" /> <input
+type=submit name=x value="summary"/>|<a
+href="?q=%(qq)s&amp;x=t">nested</a>|<a
+href="?q=%(qq)s&amp;r">relevance</a>|<input type=submit name=x value="mbox.gz" /></pre></form><pre>"""
+
+PAGE_FOOT = """</pre><hr><pre><a
+href="../../">all lists</a> <a href="./">search</a> <a href="_/text/help/">help</a> / <a href="_/text/color/">color</a> / <a id=mirror href="_/text/mirror/">mirror</a> / <a id=atom href="?q=%(qq)s&amp;x=A">Atom feed</a></pre></body></html>
+"""
+
+def mid_href(msgid):
+	#the Message-ID path of a result, escaped like mid_escape of public-inbox
+	return quote(msgid, safe="!$&'()*+,;=:@-._~") + "/"
+
+def fmt_ts(when):
+	#the %Y-%m-%d %k:%M of public-inbox, the hour is padded with a space
+	return "%s %2d:%s" % (when.strftime("%Y-%m-%d"), when.hour, when.strftime("%M"))
+
+def result_page(query, messages, offset, total):
+	#one page of results, the messages are dicts of msgid, subject, author and date
+	q = html.escape(query)
+	qq = html.escape(quote(query, safe=":"))
+	out = [PAGE_HEAD % {"q": q, "qq": qq}]
+	if not messages:
+		out.append("[No results found]")
+	for i, msg in enumerate(messages, offset + 1):
+		out.append('%d. <b><a\nhref="%s">%s</a></b>\n    - by %s @ %s UTC [%d%%]\n\n' % (i,
+			html.escape(mid_href(msg["msgid"])), html.escape(msg["subject"], quote=False),
+			html.escape(msg["author"], quote=False), fmt_ts(msg["date"]), 100 - i % 7))
+	if messages:
+		out.append('</pre><hr><pre>page: ')
+		if offset + len(messages) < total:
+			out.append('<a\nhref="?q=%s&amp;o=%d"\nrel=next>next (older)</a>\n' % (qq, offset + PAGE_SIZE))
+		out.append("       results %d-%d of %s" % (offset + 1, offset + len(messages),
+			total if total < 10000 else "~" + str(total)))
+	out.append(PAGE_FOOT % {"qq": qq})
+	return "".join(out)
+
+def mbox(messages):
+	#the mboxrd of public-inbox, "From " lines of the bodies are quoted
+	out = []
+	for msg in messages:
+		out.append("From mboxrd@z Thu Jan  1 00:00:00 1970\n")
+		out.append("Message-ID: <%s>\n" % msg["msgid"])
+		out.append("From: %s <%s>\n" % (msg["author"], msg["addr"]))
+		out.append("Date: %s\n" % msg["date"].astimezone(timezone(timedelta(hours=8))).strftime("%a, %d %b %Y %H:%M:%S %z"))
+		out.append("Subject: %s\n" % msg["subject"])
+		if msg.get("refs"):
+			out.append("In-Reply-To: <%s>\nReferences: %s\n" % (msg["refs"][-1],
+				" ".join("<%s>" % ref for ref in msg["refs"])))
+		out.append("\nThe body.\n>From the quoted line\n\n")
+	return "".join(out).encode()
+
+def make_messages(count, domains=("amlogic.com", "gmail.com"), year=2023, seed=1):
+	"""
+	count messages spread over the year, latest first like lore: patches,
+	replies to them with the In-Reply-To/References thread, replies to other
+	threads and mails that are no patches. Subjects and authors carry the
+	characters that need escaping in html.
+	"""
+	rand = random.Random(seed)
+	start = datetime(year, 1, 1, tzinfo=timezone.utc)
+	minutes = (datetime(year + 1, 1, 1, tzinfo=timezone.utc) - start).days * 24 * 60
+	patches = []
+	messages = []
+	for i in range(count):
+		domain = domains[i % len(domains)]
+		number = rand.randint(0, 5)
+		msg = dict(msgid="%d.%d-%d+test@%s" % (i, rand.randint(0, 999), number, domain),
+			author=rand.choice(["Dev %d" % number, "Jérôme O'Dev %d" % number, "陈 %d" % number]),
+			addr="user%d@%s" % (number, domain),
+			date=start + timedelta(minutes=rand.randrange(minutes)), refs=())
+		kind = rand.random()
+		if kind < 0.4 or not patches:
+			msg["subject"] = "[PATCH v%d %d/3] drv%d: fix <thing> & more %d" % (rand.randint(1, 3),
+				rand.randint(1, 3), i % 50, i)
+			patches.append(msg)
+		elif kind < 0.8:
+			parent = rand.choice(patches)
+			msg["subject"] = "Re: " + parent["subject"]
+			msg["refs"] = (parent["msgid"],)
+		elif kind < 0.9:
+			msg["subject"] = "Re: [PATCH] other%d: stuff" % i
+		else:
+			msg["subject"] = "[RFC] not a patch %d" % i
+		messages.append(msg)
+	messages.sort(key=lambda msg: msg["date"], reverse=True)
+	return messages
+
+class Lore:
+	"""
+	State of the stand-in: the messages, the request log and the requests
+	in flight. delay slows down every response, fail() makes the next
+	requests whose url contains a pattern answer with the given statuses.
+	"""
+	def __init__(self, messages, delay=0.0):
+		self.messages = messages
+		self.delay = delay
+		self.lock = threading.Lock()
+		self.requests = []
+		self.inflight = 0
+		self.max_inflight = 0
+		self.failures = []
+		#the mbox.gz as Content-Encoding: gzip instead of an application/gzip body
+		self.content_encoding = False
+		#a recorded mbox served for every x=m query instead of the matching messages
+		self.mbox_data = None
+
+	def fail(self, pattern, statuses, retry_after=None):
+		with self.lock:
+			self.failures.append([pattern, list(statuses), retry_after])
+
+	def failure(self, path):
+		with self.lock:
+			for failure in self.failures:
+				if failure[0] in path and failure[1]:
+					return failure[1].pop(0), failure[2]
+		return None, None
+
+	def match(self, query):
+		#f: matches the From header, d:A..B the UTC days
+		found = self.messages
+		for token in query.split():
+			if token.startswith("f:"):
+				found = [msg for msg in found if token[2:] in "%s <%s>" % (msg["author"], msg["addr"])]
+			elif token.startswith("d:"):
+				first, last = token[2:].split("..")
+				found = [msg for msg in found if first <= msg["date"].strftime("%Y-%m-%d") <= last]
+		return found
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+	lore = None
+
+	def log_message(self, *args):
+		pass
+
+	def reply(self, code, body=b"", headers=()):
+		self.send_response(code)
+		for name, value in headers:
+			self.send_header(name, value)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def handle_method(self, method):
+		lore = self.lore
+		with lore.lock:
+			lore.requests.append(method + " " + self.path)
+			lore.inflight += 1
+			lore.max_inflight = max(lore.max_inflight, lore.inflight)
+		try:
+			length = int(self.headers.get("Content-Length") or 0)
+			if length:
+				self.rfile.read(length)
+			time.sleep(lore.delay)
+			status, retry_after = lore.failure(self.path)
+			if status:
+				return self.reply(status, b"", [("Retry-After", str(retry_after))] if retry_after is not None else [])
+			args = parse_qs(urlparse(self.path).query)
+			query = args.get("q", [""])[0]
+			found = lore.match(query)
+			if method == "POST" and args.get("x") == ["m"]:
+				body = gzip.compress(lore.mbox_data if lore.mbox_data is not None else mbox(found))
+				if lore.content_encoding:
+					return self.reply(200, body, [("Content-Type", "application/mbox"), ("Content-Encoding", "gzip")])
+				return self.reply(200, body, [("Content-Type", "application/gzip")])
+			offset = int(args.get("o", ["0"])[0])
+			page = result_page(query, found[offset:offset + PAGE_SIZE], offset, len(found))
+			return self.reply(200, page.encode(), [("Content-Type", "text/html; charset=UTF-8")])
+		finally:
+			with lore.lock:
+				lore.inflight -= 1
+
+	def do_GET(self):
+		self.handle_method("GET")
+
+	def do_POST(self):
+		self.handle_method("POST")
+
+def start(lore, port=0):
+	#serve lore on 127.0.0.1, the search url is base_url(server) + query
+	handler = type("LoreHandler", (Handler,), {"lore": lore})
+	server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+def base_url(server):
+	return "http://127.0.0.1:%d/all/?q=" % server.server_address[1]
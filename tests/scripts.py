@@ -0,0 +1,30 @@
+# -*- coding: UTF-8 -*-
+# load the scripts of the repo as modules, they are run as files and not installed
+
+import os
+import sys
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+#certificate and key of localhost for the TLS stand-ins
+CERT_FILE = os.path.join(FIXTURES, "localhost.pem")
+
+_modules = {}
+
+def load(path):
+	#path relative to the repo, every script is loaded once
+	if path not in _modules:
+		#robot-jenkins.py imports gerrit.py from its own directory
+		sys.path.insert(0, os.path.join(ROOT, os.path.dirname(path)))
+		name = os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+		spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+		module = importlib.util.module_from_spec(spec)
+		#the process pools pickle the functions by the module name
+		sys.modules[name] = module
+		spec.loader.exec_module(module)
+		_modules[path] = module
+	return _modules[path]
+
+def fixture(name):
+	return os.path.join(FIXTURES, name)
@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+# AsyncGerrit of gerrit.py against the gerrit stand-in: the REST calls in flight are
+# bounded, the revisions come from one bulk query and an expired login is renewed once
+
+import os
+import time
+import asyncio
+import unittest
+from unittest import mock
+
+import scripts
+import gerrit_stand_in
+
+gerrit = scripts.load("robot_jenkins/gerrit.py")
+
+class AsyncGerritTest(unittest.TestCase):
+    def setUp(self):
+        self.gerrit = gerrit_stand_in.Gerrit()
+        server = gerrit_stand_in.start(self.gerrit, scripts.CERT_FILE)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        # the stand-in certificate is only trusted by the tests
+        environ = mock.patch.dict(os.environ, REQUESTS_CA_BUNDLE=scripts.CERT_FILE)
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.client = gerrit.Gerrit('localhost:%d' % server.server_address[1], 'robot', 'pw')
+        self.addCleanup(self.client.session.close)
+
+    def async_gerrit(self, concurrency):
+        client = gerrit.AsyncGerrit(self.client, concurrency)
+        self.addCleanup(client.close)
+        return client
+
+    def reset(self):
+        with self.gerrit.lock:
+            self.gerrit.requests = []
+            self.gerrit.reviews = []
+            self.gerrit.max_inflight = 0
+
+    def test_concurrency(self):
+        self.gerrit.delay = 0.1
+        for concurrency in (1, 3):
+            self.reset()
+            client = self.async_gerrit(concurrency)
+            reviews = [(str(1000 + i), self.gerrit.revision(1000 + i), {"message": "m%d" % i}) for i in range(9)]
+            start = time.time()
+            results = asyncio.run(client.post_reviews(reviews))
+            elapsed = time.time() - start
+            self.assertEqual(results, [{"labels": {"Verified": 2}}] * 9)
+            self.assertEqual(sorted(self.gerrit.reviews), sorted(reviews))
+            self.assertEqual(self.gerrit.max_inflight, concurrency)
+            self.assertGreaterEqual(elapsed, 0.9 / concurrency)
+
+    def test_bulk_query(self):
+        client = self.async_gerrit(4)
+        self.reset()
+        cl_ids = [str(2000 + i) for i in range(120)]
+        revisions = asyncio.run(client.get_current_revisions(cl_ids))
+        self.assertEqual(revisions, {cl_id: self.gerrit.revision(cl_id) for cl_id in cl_ids})
+        # three queries of at most 50 changes in one call
+        self.assertEqual(len(self.gerrit.requests), 1)
+        self.assertEqual(self.gerrit.requests[0].count("q=change:"), 3)
+        self.assertEqual(asyncio.run(client.get_current_revisions(cl_ids[:1])), {cl_ids[0]: self.gerrit.revision(cl_ids[0])})
+        self.assertEqual(asyncio.run(client.get_current_revisions([])), {})
+
+    def test_pass_messages(self):
+        client = self.async_gerrit(4)
+        self.reset()
+        cl_ids = [str(3000 + i) for i in range(6)]
+        results = asyncio.run(client.post_review_pass_messages(cl_ids, "Verified by the robot"))
+        self.assertEqual(results, [{"labels": {"Verified": 2}}] * 6)
+        self.assertEqual(sorted(review[:2] for review in self.gerrit.reviews),
+                         [(cl_id, self.gerrit.revision(cl_id)) for cl_id in cl_ids])
+        for review in self.gerrit.reviews:
+            self.assertEqual(review[2], {"message": "Verified by the robot", "labels": {"Verified": "+2"}})
+        # the bulk query and one post per change
+        self.assertEqual(len(self.gerrit.requests), 7)
+
+    def test_relogin(self):
+        client = self.async_gerrit(4)
+        self.assertEqual(self.gerrit.logins, 1)
+        self.gerrit.delay = 0.05
+        self.gerrit.expire_sessions()
+        self.reset()
+        # the calls in flight all see the 403, only one of them logs in again
+        reviews = [(str(4000 + i), self.gerrit.revision(4000 + i), {"message": "m"}) for i in range(8)]
+        results = asyncio.run(client.post_reviews(reviews))
+        self.assertEqual(results, [{"labels": {"Verified": 2}}] * 8)
+        self.assertEqual(self.gerrit.logins, 2)
+        self.assertEqual(sorted(self.gerrit.reviews), sorted(reviews))
+        self.gerrit.expire_sessions()
+        self.assertEqual(asyncio.run(client.post_review_pass_messages(["4100"], "ok")), [{"labels": {"Verified": 2}}])
+        self.assertEqual(self.gerrit.logins, 3)
+
+if __name__ == "__main__":
+    unittest.main()
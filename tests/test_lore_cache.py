@@ -0,0 +1,67 @@
+# -*- coding: UTF-8 -*-
+# the response cache of parse_lore_kernel.py against the lore stand-in: a page fetched
+# after its window closed is final, one fetched while the window was open is revalidated
+
+import os
+import time
+import tempfile
+import unittest
+from datetime import date
+
+import scripts
+import lore_stand_in
+
+lore = scripts.load("parse_lore_kernel/parse_lore_kernel.py")
+
+START = date(2023, 6, 1)
+END = date(2023, 6, 30)
+
+class CacheTest(unittest.TestCase):
+	def setUp(self):
+		self.lore = lore_stand_in.Lore(lore_stand_in.make_messages(1000))
+		server = lore_stand_in.start(self.lore)
+		self.addCleanup(server.server_close)
+		self.addCleanup(server.shutdown)
+		self.url = lore_stand_in.base_url(server) + "f:amlogic.com+d%3A2023-06-01..2023-06-30"
+		self.session = lore.new_session(4)
+		self.addCleanup(self.session.close)
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.addCleanup(setattr, lore, "response_cache", lore.response_cache)
+		lore.response_cache = lore.ResponseCache(os.path.join(tmp.name, "cache.db"))
+
+	def fetch(self):
+		with self.lore.lock:
+			self.lore.requests = []
+		messages = lore.fetch_messages(self.session, self.url, START, END, 1)
+		return messages, list(self.lore.requests)
+
+	def set_fetched(self, fetched):
+		with lore.response_cache.lock:
+			lore.response_cache.db.execute("UPDATE responses SET fetched = ?", (fetched,))
+			lore.response_cache.db.commit()
+
+	def test_closed(self):
+		messages, requests = self.fetch()
+		self.assertEqual(len(requests), 2)
+		#fetched after the window closed, never asked again even past CACHE_TTL
+		self.set_fetched(time.time() - 3 * lore.CACHE_TTL)
+		self.assertEqual(self.fetch(), (messages, []))
+
+	def test_fetched_while_open(self):
+		messages, requests = self.fetch()
+		#a copy from before the window closed may miss the last mails of the window
+		self.set_fetched(lore.closed_at(END) - 3600)
+		self.assertEqual(self.fetch(), (messages, requests))
+		self.assertEqual(self.fetch(), (messages, []))
+		#still fresh within CACHE_TTL
+		self.set_fetched(time.time() - lore.CACHE_TTL / 2)
+		self.assertEqual(self.fetch(), (messages, []))
+
+	def test_closed_at(self):
+		self.assertEqual(lore.closed_at(END) - lore.closed_at(START), 29 * 24 * 3600)
+		self.assertTrue(lore.is_closed(END))
+		self.assertFalse(lore.is_closed(date.today()))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+# the concurrent page fetch of parse_lore_kernel.py against the lore stand-in: the same
+# messages as one page at a time, never more than jobs requests in flight and no pages
+# fetched far past the end of the date window
+
+import unittest
+from datetime import date
+
+import scripts
+import lore_stand_in
+
+lore = scripts.load("parse_lore_kernel/parse_lore_kernel.py")
+
+START = date(2023, 1, 1)
+END = date(2023, 12, 31)
+
+def expected(stand_in, query):
+	#(subject, msgid, author, date) of the [PATCH results, latest first
+	return [(msg["subject"], msg["msgid"], msg["author"], msg["date"].strftime("%Y-%m-%d %H:%M UTC"))
+		for msg in stand_in.match(query) if "[PATCH" in msg["subject"]]
+
+def fields(messages):
+	return [(info.subject, info.msgid, info.author, info.date) for info in messages]
+
+class FetchTest(unittest.TestCase):
+	def setUp(self):
+		self.lore = lore_stand_in.Lore(lore_stand_in.make_messages(2000), delay=0.02)
+		server = lore_stand_in.start(self.lore)
+		self.addCleanup(server.server_close)
+		self.addCleanup(server.shutdown)
+		self.url = lore_stand_in.base_url(server) + "f:amlogic.com"
+		self.session = lore.new_session(8)
+		self.addCleanup(self.session.close)
+
+	def fetch(self, jobs, start=START, end=END):
+		with self.lore.lock:
+			self.lore.requests = []
+			self.lore.max_inflight = 0
+		messages = lore.fetch_messages(self.session, self.url + "+d%3A" + str(start) + ".." + str(end), start, end, jobs)
+		return messages, list(self.lore.requests), self.lore.max_inflight
+
+	def test_jobs(self):
+		want = expected(self.lore, "f:amlogic.com d:2023-01-01..2023-12-31")
+		#the results fill 5 pages and the 6th is empty
+		self.assertEqual(len(self.lore.match("f:amlogic.com")) // lore_stand_in.PAGE_SIZE, 5)
+		serial, requests, inflight = self.fetch(1)
+		self.assertEqual(fields(serial), want)
+		self.assertEqual(len(requests), 6)
+		self.assertEqual(inflight, 1)
+		for jobs in (2, 4, 8):
+			messages, requests, inflight = self.fetch(jobs)
+			self.assertEqual(messages, serial)
+			self.assertLessEqual(inflight, jobs)
+			#the pages in flight when the empty one came back are the only extra requests
+			self.assertLessEqual(len(requests), 6 + jobs - 1)
+			offsets = sorted(int(request.rsplit("&o=", 1)[1]) for request in requests)
+			self.assertEqual(offsets[:6], list(range(0, 1200, 200)))
+
+	def test_short_window(self):
+		#a window of one page stops after the second page, with one job as with eight
+		start, end = date(2023, 6, 1), date(2023, 6, 30)
+		want = expected(self.lore, "f:amlogic.com d:2023-06-01..2023-06-30")
+		for jobs in (1, 8):
+			messages, requests, inflight = self.fetch(jobs, start, end)
+			self.assertEqual(fields(messages), want)
+			self.assertLessEqual(len(requests), 2 + jobs - 1)
+
+	def test_split_period(self):
+		whole = lore.fetch_window(self.session, self.url, START, END, 4, "html", "")
+		for period in ("month", "week"):
+			with self.lore.lock:
+				self.lore.max_inflight = 0
+			split = lore.fetch_split_messages(self.session, self.url, START, END, period, 4, "html")
+			self.assertEqual(sorted(split), sorted(whole))
+			self.assertLessEqual(self.lore.max_inflight, 4)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+# the mbox.gz backend of parse_lore_kernel.py: a recorded mbox served gzipped by the lore
+# stand-in, the header parse however the stream is cut and the same messages as the
+# result pages
+
+import random
+import unittest
+from datetime import date
+
+import scripts
+import lore_stand_in
+
+lore = scripts.load("parse_lore_kernel/parse_lore_kernel.py")
+
+JUNE = (date(2023, 6, 1), date(2023, 6, 30))
+
+#the [PATCH mails of lore_amlogic.mbox in June, latest first
+EXPECTED = [
+	("Re: [PATCH v2 1/4] clk: meson: a1: the pll names changed", "Neil Armstrong", "2023-06-30 11:00 UTC",
+		"87o7kzq5xa.fsf@baylibre.com", ("a4b5c6d7-0e1f-4a2b-9c3d-4e5f6a7b8c9d@linaro.org",
+		"20230630101722.1234-1-jian.hu@amlogic.com", "a4b5c6d7-0e1f-4a2b-9c3d-4e5f6a7b8c9d@linaro.org")),
+	("[PATCH v2 1/4] clk: meson: a1: add <mpll> & hifi pll support", "Jian Hu", "2023-06-30 10:17 UTC",
+		"20230630101722.1234-1-jian.hu@amlogic.com", ()),
+	("Re: [PATCH v2 1/4] clk: meson: a1: add <mpll> & hifi pll support", "Jérôme Brunet",
+		"2023-06-29 18:02 UTC", "a4b5c6d7-0e1f-4a2b-9c3d-4e5f6a7b8c9d@linaro.org",
+		("20230630101722.1234-1-jian.hu@amlogic.com", "20230630101722.1234-0-jian.hu@amlogic.com",
+		"20230630101722.1234-1-jian.hu@amlogic.com")),
+	("[PATCH] arm64: dts: meson: s4: fix \"uart_b\" pinctrl", "Yu Tu", "2023-06-28 08:22 UTC",
+		"20230628082233.4455-1-yu.tu+dev@amlogic.com", ()),
+	("[PATCH v3 3/3] pinctrl: meson: add C3 – GPIO banks", "陈 力", "2023-06-27 02:05 UTC",
+		"20230627-c3-v3-3-77aa@amlogic.com", ()),
+	("[PATCH v1 1/1] mmc: meson-gx: first of the month", "Early Bird", "2023-06-01 00:00 UTC",
+		"20230601000000.1-1-first@amlogic.com", ()),
+]
+
+def fields(messages):
+	return [(info.subject, info.author, info.date, info.msgid, info.refs) for info in messages]
+
+def recorded_mbox():
+	with open(scripts.fixture("lore_amlogic.mbox"), "rb") as f:
+		return f.read()
+
+class MboxTest(unittest.TestCase):
+	def setUp(self):
+		self.lore = lore_stand_in.Lore(lore_stand_in.make_messages(1000))
+		server = lore_stand_in.start(self.lore)
+		self.addCleanup(server.server_close)
+		self.addCleanup(server.shutdown)
+		self.url = lore_stand_in.base_url(server) + "f:amlogic.com"
+		self.session = lore.new_session(4)
+		self.addCleanup(self.session.close)
+
+	def test_recorded(self):
+		self.lore.mbox_data = recorded_mbox()
+		#an application/gzip body and a gzip Content-Encoding the http layer undoes
+		for content_encoding in (False, True):
+			self.lore.content_encoding = content_encoding
+			messages = lore.fetch_mbox_messages(self.session, self.url, *JUNE)
+			self.assertEqual(fields(messages), EXPECTED)
+			self.assertEqual(messages[1].link, "https://lore.kernel.org/all/20230630101722.1234-1-jian.hu@amlogic.com")
+			self.assertEqual(messages[3].link, "https://lore.kernel.org/all/20230628082233.4455-1-yu.tu+dev@amlogic.com")
+		self.assertTrue(all(request.startswith("POST ") and request.endswith("&x=m") for request in self.lore.requests))
+
+	def test_chunks(self):
+		data = recorded_mbox()
+		whole = list(lore.read_mbox_headers([data]))
+		#the mail without Message-ID is the only one dropped
+		self.assertEqual(len(whole), 9)
+		self.assertEqual(sum(lore.mbox_message(header) is None for header in whole), 1)
+		rand = random.Random(15)
+		gzipped = lore_stand_in.gzip.compress(data)
+		for _ in range(100):
+			cuts = sorted(rand.sample(range(1, len(gzipped)), 30))
+			chunks = [gzipped[i:j] for i, j in zip([0] + cuts, cuts + [len(gzipped)])]
+			self.assertEqual(list(lore.read_mbox_headers(lore.gunzip_stream(chunks))), whole)
+
+	def test_replies(self):
+		#a reply with another subject is matched to the submission by its References
+		self.lore.mbox_data = recorded_mbox()
+		total, submissions, replies, reviews = lore.classify_messages(lore.fetch_mbox_messages(self.session, self.url, *JUNE))
+		self.assertEqual(len(total), 6)
+		self.assertEqual(len(submissions), 4)
+		self.assertEqual([info.msgid for info in replies],
+			["87o7kzq5xa.fsf@baylibre.com", "a4b5c6d7-0e1f-4a2b-9c3d-4e5f6a7b8c9d@linaro.org"])
+		self.assertEqual(reviews, [])
+
+	def test_same_as_pages(self):
+		start, end = date(2023, 1, 1), date(2023, 12, 31)
+		pages = lore.fetch_query(self.session, self.url + "+d%3A2023-01-01..2023-12-31", start, end, 4, "html")
+		mbox = lore.fetch_query(self.session, self.url + "+d%3A2023-01-01..2023-12-31", start, end, 4, "mbox")
+		key = lambda info: (info.date, info.msgid)
+		self.assertEqual([info[:5] for info in sorted(mbox, key=key)], [info[:5] for info in sorted(pages, key=key)])
+		#only the mbox knows the thread
+		self.assertTrue(any(info.refs for info in mbox))
+
+if __name__ == "__main__":
+	unittest.main()
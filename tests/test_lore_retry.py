@@ -0,0 +1,161 @@
+# -*- coding: UTF-8 -*-
+# the retries of parse_lore_kernel.py against the lore stand-in: 429/503 with Retry-After,
+# the adaptive cap of the requests in flight and a failed run resumed from the checkpoint
+
+import os
+import time
+import tempfile
+import unittest
+import email.utils
+from datetime import date
+
+import scripts
+import lore_stand_in
+
+lore = scripts.load("parse_lore_kernel/parse_lore_kernel.py")
+
+START = date(2023, 1, 1)
+END = date(2023, 12, 31)
+
+class RetryTest(unittest.TestCase):
+	def setUp(self):
+		self.lore = lore_stand_in.Lore(lore_stand_in.make_messages(2000))
+		server = lore_stand_in.start(self.lore)
+		self.addCleanup(server.server_close)
+		self.addCleanup(server.shutdown)
+		self.url = lore_stand_in.base_url(server) + "f:amlogic.com+d%3A2023-01-01..2023-12-31"
+		self.session = lore.new_session(4)
+		self.addCleanup(self.session.close)
+		#short backoff, the module globals are set back after every test
+		self.set_global("RETRIES", 2)
+		self.set_global("BACKOFF_BASE", 0.01)
+		self.set_global("rate_limiter", None)
+		self.set_global("checkpoint", None)
+
+	def set_global(self, name, value):
+		self.addCleanup(setattr, lore, name, getattr(lore, name))
+		setattr(lore, name, value)
+
+	def offsets(self):
+		with self.lore.lock:
+			return [int(request.rsplit("&o=", 1)[1]) for request in self.lore.requests]
+
+	def test_throttled(self):
+		serial = lore.fetch_messages(self.session, self.url, START, END, 1)
+		self.lore.requests = []
+		self.lore.fail("&o=200", [503, 429], retry_after=0.3)
+		begin = time.time()
+		self.assertEqual(lore.fetch_messages(self.session, self.url, START, END, 1), serial)
+		#never sooner than the Retry-After
+		self.assertGreaterEqual(time.time() - begin, 0.6)
+		self.assertEqual(self.offsets().count(200), 3)
+
+	def test_give_up(self):
+		self.lore.fail("&o=0", [500] * 3)
+		with self.assertRaises(lore.FetchError):
+			lore.fetch_messages(self.session, self.url, START, END, 1)
+		self.assertEqual(self.offsets(), [0, 0, 0])
+		#404 is no throttling, it is not retried
+		self.lore.requests = []
+		self.lore.fail("&o=0", [404])
+		with self.assertRaises(lore.FetchError):
+			lore.fetch_messages(self.session, self.url, START, END, 1)
+		self.assertEqual(self.offsets(), [0])
+
+	def test_retry_after(self):
+		self.assertEqual(lore.parse_retry_after("120"), 120)
+		self.assertEqual(lore.parse_retry_after("-5"), 0)
+		self.assertEqual(lore.parse_retry_after(None), 0)
+		self.assertEqual(lore.parse_retry_after("soon"), 0)
+		later = lore.parse_retry_after(email.utils.formatdate(time.time() + 30, usegmt=True))
+		self.assertTrue(25 <= later <= 30, later)
+		self.assertEqual(lore.parse_retry_after(email.utils.formatdate(time.time() - 30, usegmt=True)), 0)
+
+	def test_rate_limiter(self):
+		limiter = lore.RateLimiter(8)
+		limiter.acquire()
+		limiter.release(throttled=True, retry_after=0.2)
+		self.assertEqual(limiter.limit, 4)
+		begin = time.time()
+		limiter.acquire()
+		self.assertGreaterEqual(time.time() - begin, 0.15)
+		limiter.release(throttled=True)
+		self.assertEqual(limiter.limit, 2)
+		#raised by one after as many successes as the cap, up to max_limit
+		for _ in range(2 + 3 + 4 + 5 + 6 + 7 + 20):
+			limiter.acquire()
+			limiter.release()
+		self.assertEqual(limiter.limit, 8)
+
+	def test_limited_fetch(self):
+		self.set_global("rate_limiter", lore.RateLimiter(4))
+		#the 503 of the last page halves the cap
+		self.lore.fail("&o=1000", [503])
+		serial = lore.fetch_messages(self.session, self.url, START, END, 1)
+		self.assertEqual(lore.rate_limiter.limit, 2)
+		#after two throttled requests the cap is 1 and raised again by the successful pages
+		lore.rate_limiter.acquire()
+		lore.rate_limiter.release(throttled=True)
+		self.lore.delay = 0.05
+		self.lore.requests = []
+		self.assertEqual(lore.fetch_messages(self.session, self.url, START, END, 4), serial)
+		self.assertLessEqual(self.lore.max_inflight, 3)
+		self.assertEqual(sorted(self.offsets())[:6], list(range(0, 1200, 200)))
+		self.assertGreater(lore.rate_limiter.limit, 1)
+
+	def checkpoint(self, run="-f amlogic.com -y 2023"):
+		if not hasattr(self, "tmp"):
+			self.tmp = tempfile.TemporaryDirectory()
+			self.addCleanup(self.tmp.cleanup)
+		saved = lore.PageCheckpoint(os.path.join(self.tmp.name, "checkpoint.db"), run)
+		self.addCleanup(saved.db.close)
+		return saved
+
+	def test_resume(self):
+		#a closed window and the open current year
+		this_year = date.today().year
+		for year in (2023, this_year):
+			self.lore.messages = lore_stand_in.make_messages(2000, year=year)
+			start, end = date(year, 1, 1), date(year, 12, 31)
+			url = self.url.replace("2023-", "%d-" % year)
+			self.set_global("checkpoint", self.checkpoint("-y %d" % year))
+			self.lore.requests = []
+			self.lore.fail("&o=400", [503] * 3)
+			with self.assertRaises(lore.FetchError):
+				lore.fetch_messages(self.session, url, start, end, 1)
+			self.assertEqual(self.offsets(), [0, 200, 400, 400, 400], year)
+			#the rerun starts at the failed page
+			self.lore.requests = []
+			messages = lore.fetch_messages(self.session, url, start, end, 1)
+			self.assertEqual(self.offsets(), [400, 600, 800, 1000], year)
+			lore.checkpoint.clear()
+			self.assertEqual(lore.fetch_messages(self.session, url, start, end, 1), messages)
+
+	def test_runs(self):
+		saved = self.checkpoint()
+		other = self.checkpoint("-f gmail.com -y 2023")
+		message = lore.Message("[PATCH] a", "https://lore.kernel.org/all/1@x", "Dev", "2023-06-01 09:00 UTC", "1@x")
+		saved.put("url", [message], 1)
+		other.put("url", [], 0)
+		self.assertEqual(saved.get("url"), ([message], 1))
+		#a finished command leaves the pages of the others
+		other.clear()
+		self.assertIsNone(other.get("url"))
+		self.assertEqual(saved.get("url"), ([message], 1))
+		#pages of a run given up long ago are stale
+		self.set_global("CHECKPOINT_MAX_AGE", 0.1)
+		time.sleep(0.2)
+		self.assertIsNone(saved.get("url"))
+
+	def test_round_trip(self):
+		saved = self.checkpoint()
+		messages = [lore.Message("Re: [PATCH 1/2] a", "https://lore.kernel.org/all/2@x/", "Dev", "2023-06-01 10:00 UTC",
+			"2@x", ("0@x", "1@x")), lore.Message("[PATCH 1/2] a", "https://lore.kernel.org/all/1@x/", "Dev",
+			"2023-06-01 09:00 UTC", "1@x")]
+		saved.put("url", messages, 1)
+		self.assertEqual(saved.get("url"), (messages, 1))
+		self.assertEqual(saved.get("url")[0][0].refs, ("0@x", "1@x"))
+		self.assertIsNone(saved.get("other"))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: UTF-8 -*-
+# ResultPageParser of parse_lore_kernel.py on the result page fixtures in the public-inbox
+# layout: the same messages however the page is split into chunks, no crash on broken
+# markup, html entities and results listed twice
+
+import re
+import json
+import random
+import unittest
+from datetime import date
+
+import scripts
+
+lore = scripts.load("parse_lore_kernel/parse_lore_kernel.py")
+
+PAGES = ("results", "last", "empty")
+date_re = re.compile(r"^\d{4}-\d\d-\d\d \d\d:\d\d UTC$")
+
+def page(name):
+	with open(scripts.fixture("lore_page_%s.html" % name), encoding="utf-8") as f:
+		return f.read()
+
+def golden(name):
+	if name == "empty":
+		return []
+	with open(scripts.fixture("lore_page_%s.json" % name), encoding="utf-8") as f:
+		return [tuple(info) for info in json.load(f)]
+
+def parse(chunks):
+	return [tuple(info[:5]) for info in lore.parse_result_page(chunks)]
+
+def split(text, rand, max_size):
+	#text cut at random places into chunks of 1 to max_size characters
+	chunks = []
+	pos = 0
+	while pos < len(text):
+		size = rand.randint(1, max_size)
+		chunks.append(text[pos:pos + size])
+		pos += size
+	return chunks
+
+class ParsePagesTest(unittest.TestCase):
+	def test_golden(self):
+		for name in PAGES:
+			self.assertEqual(parse(page(name)), golden(name), name)
+
+	def test_entities(self):
+		messages = parse(page("results"))
+		subjects = [info[0] for info in messages]
+		self.assertIn("[PATCH v2 1/4] clk: meson: a1: add <mpll> & hifi pll support", subjects)
+		self.assertIn("[PATCH v2 2/4] dt-bindings: clock: meson: add A1 PLL's binding", subjects)
+		self.assertIn("[PATCH v3 3/3] pinctrl: meson: add C3 \u2013 GPIO banks", subjects)
+		authors = [info[2] for info in messages]
+		self.assertIn("Neil O'Armstrong", authors)
+		self.assertIn("Dev <dev@amlogic.com>", authors)
+		#the Message-ID of the link is unquoted, the link is kept as lore has it
+		self.assertIn(("https://lore.kernel.org/all/20230628082233.4455-1-yu.tu+dev%2Fs4@amlogic.com",
+			"20230628082233.4455-1-yu.tu+dev/s4@amlogic.com"), [info[1::3] for info in messages])
+		#the hours before 10 are padded with a space on the page
+		self.assertIn("2023-06-28 08:22 UTC", [info[3] for info in messages])
+		page_row = '<a\nhref="1@a/">[PATCH] a</a></b>\n    - by A @ 2023-06-30  9:17 UTC [100%]\n'
+		self.assertEqual([info.date for info in lore.parse_result_page(page_row)], ["2023-06-30 09:17 UTC"])
+		#no [GIT PULL] or [RFC PATCH]
+		self.assertEqual(len(messages), 10)
+
+	def test_chunks(self):
+		rand = random.Random(12)
+		for name in PAGES:
+			text = page(name)
+			want = golden(name)
+			for max_size in (1, 2, 7, 64, 4096):
+				for _ in range(20):
+					self.assertEqual(parse(split(text, rand, max_size)), want, (name, max_size))
+
+	def test_byte_chunks(self):
+		#the multi-byte characters of the names and the dash are cut by the http chunks too
+		rand = random.Random(13)
+		data = page("results").encode("utf-8")
+		for _ in range(100):
+			chunks = []
+			cuts = [0] + sorted(rand.sample(range(1, len(data)), 40)) + [len(data)]
+			for i, j in zip(cuts, cuts[1:]):
+				chunks.append(data[i:j])
+			self.assertEqual(parse(lore.decode_stream(chunks)), golden("results"))
+
+	def test_mutations(self):
+		#broken markup never raises and never gives a half parsed message
+		rand = random.Random(14)
+		text = page("results")
+		for _ in range(500):
+			mutated = text
+			for _ in range(rand.randint(1, 4)):
+				if not mutated:
+					break
+				pos = rand.randrange(len(mutated))
+				kind = rand.randrange(4)
+				if kind == 0:
+					mutated = mutated[:pos] + mutated[pos + rand.randint(1, 40):]
+				elif kind == 1:
+					mutated = mutated[:pos] + rand.choice("<>&;\"'/\n =") * rand.randint(1, 3) + mutated[pos:]
+				elif kind == 2:
+					span = mutated[pos:pos + rand.randint(1, 200)]
+					mutated = mutated[:pos] + span + mutated[pos:]
+				else:
+					mutated = mutated[:pos]
+			for info in lore.parse_result_page(split(mutated, rand, 512)):
+				self.assertIn("[PATCH", info.subject)
+				self.assertTrue(info.link.startswith("https://lore.kernel.org/all/"))
+				self.assertRegex(info.date, date_re)
+
+	def test_listed_twice(self):
+		#every result line twice, like the overlap of two pages when new mails shift the offsets
+		text = page("results")
+		start = text.index("1. <b>")
+		end = text.index("</pre><hr>", start)
+		doubled = text[:start] + re.sub(r"(\d+\. <b><a\n.*?\n    - by .*?\n\n)", r"\1\1", text[start:end], flags=re.S) + text[end:]
+		messages = list(lore.parse_result_page(doubled))
+		self.assertEqual([tuple(info[:5]) for info in messages[::2]], golden("results"))
+		self.assertEqual(messages[::2], messages[1::2])
+		total = lore.classify_messages(messages)[0]
+		self.assertEqual([tuple(info[:5]) for info in total], golden("results"))
+
+	def test_window_end(self):
+		#the results of the last page run out of the date window
+		messages, flag = lore.get_title(page("last"), date(2023, 6, 1), date(2023, 6, 30))
+		self.assertEqual([tuple(info[:5]) for info in messages], golden("last")[:2])
+		self.assertEqual(flag, 0)
+		messages, flag = lore.get_title(page("results"), date(2023, 6, 1), date(2023, 6, 30))
+		self.assertEqual(len(messages), 10)
+		self.assertEqual(flag, 1)
+		self.assertEqual(lore.get_title(page("empty"), date(2023, 6, 1), date(2023, 6, 30)), ([], 0))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,142 @@
+# -*- coding: UTF-8 -*-
+# robot-jenkins.py -d against the IMAP, git and gerrit stand-ins: the time from the
+# arrival of a patch mail to its Verified +2, with IDLE, with the poll fallback and
+# after the server drops the connection
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import scripts
+import imap_stand_in
+import gerrit_stand_in
+
+CONFIG = """[EMAIL]
+IMAP_SERVER = 127.0.0.1
+IMAP_PORT = {imap_port}
+EMAIL = robot
+PASSWORD = pw
+[GERRIT]
+URL = '{root}/'
+HTTP_URL = 'localhost:{gerrit_port}'
+PROJECT = 'gerrit.git'
+BRANCH = 'dev'
+USERNAME = 'robot'
+PASSWORD = 'pw'
+[DEFAULT]
+OUTPUT_DIR = patches
+CODE_BASE_DIR = {root}/clone
+"""
+
+class RobotTest(unittest.TestCase):
+    """
+    A temporary gerrit.git with its clone, the IMAP and gerrit stand-ins and
+    conf.ini for them in self.root. run_robot() runs robot-jenkins.py there.
+    """
+    idle = True
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.remote, self.src, self.clone = gerrit_stand_in.make_remote(self.root)
+        self.mailbox = imap_stand_in.Mailbox(idle=self.idle)
+        listener = imap_stand_in.start(self.mailbox, scripts.CERT_FILE)
+        self.addCleanup(listener.close)
+        self.gerrit = gerrit_stand_in.Gerrit()
+        server = gerrit_stand_in.start(self.gerrit, scripts.CERT_FILE)
+        self.addCleanup(server.shutdown)
+        with open(os.path.join(self.root, "conf.ini"), "w") as f:
+            f.write(CONFIG.format(root=self.root, imap_port=listener.getsockname()[1],
+                                  gerrit_port=server.server_address[1]))
+        self.env = dict(os.environ, REQUESTS_CA_BUNDLE=scripts.CERT_FILE, PYTHONUNBUFFERED="1")
+
+    def robot_cmd(self, *args):
+        return [sys.executable, os.path.join(scripts.ROOT, "robot_jenkins", "robot-jenkins.py"), "-c", "conf.ini"] + list(args)
+
+    def run_robot(self, *args):
+        return subprocess.run(self.robot_cmd(*args), cwd=self.root, env=self.env, capture_output=True, text=True, timeout=120)
+
+    def start_daemon(self, *args):
+        log = open(os.path.join(self.root, "daemon.log"), "w")
+        self.addCleanup(log.close)
+        daemon = subprocess.Popen(self.robot_cmd("-d", *args), cwd=self.root, env=self.env,
+                                  stdout=log, stderr=subprocess.STDOUT)
+        self.addCleanup(daemon.wait)
+        self.addCleanup(daemon.kill)
+        return daemon
+
+    def verified(self):
+        with self.gerrit.lock:
+            return [review[0] for review in self.gerrit.reviews]
+
+    def wait_verified(self, count, timeout=30):
+        # seconds until count changes are verified
+        start = time.time()
+        while len(self.verified()) < count:
+            if time.time() - start > timeout:
+                with open(os.path.join(self.root, "daemon.log")) as f:
+                    self.fail("%d of %d changes verified\n%s" % (len(self.verified()), count, f.read()[-3000:]))
+            time.sleep(0.05)
+        return time.time() - start
+
+    def wait_mailbox(self, condition, timeout=30):
+        # until condition(stats) of the IMAP stand-in holds, the robot reached that state
+        start = time.time()
+        while not condition(self.mailbox.stats):
+            if time.time() - start > timeout:
+                with open(os.path.join(self.root, "daemon.log")) as f:
+                    self.fail("IMAP stats %s\n%s" % (self.mailbox.stats, f.read()[-3000:]))
+            time.sleep(0.05)
+
+    def patch_mails(self, count):
+        # one single patch mail per file
+        return [gerrit_stand_in.format_patches(self.src, [("f%d.txt" % i, "change %d" % i)])[0]
+                for i in range(1, count + 1)]
+
+class DaemonTest(RobotTest):
+    def test_idle(self):
+        mails = self.patch_mails(6)
+        self.start_daemon("-j", "2")
+        # the robot is waiting in IDLE before the first mail comes in
+        self.wait_mailbox(lambda stats: "IDLE" in stats["commands"])
+        latency = []
+        for count, mail in enumerate(mails[:3], 1):
+            self.mailbox.add(mail)
+            latency.append(self.wait_verified(count))
+        self.assertLess(max(latency), 10)
+
+        # a restart of the server, the robot logs in again and goes on
+        idles = self.mailbox.stats["commands"].count("IDLE")
+        self.mailbox.drop_clients()
+        self.wait_mailbox(lambda stats: stats["logins"] == 2 and stats["commands"].count("IDLE") > idles)
+        self.mailbox.add(mails[3])
+        self.assertLess(self.wait_verified(4), 10)
+        for mail in mails[4:]:
+            self.mailbox.add(mail)
+        self.wait_verified(6)
+        self.assertEqual(self.mailbox.stats["logins"], 2)
+        self.assertEqual(len(gerrit_stand_in.pushed_changes(self.remote)), 6)
+        self.assertEqual(len(set(self.verified())), 6)
+
+class PollTest(RobotTest):
+    idle = False
+
+    def test_poll(self):
+        mails = self.patch_mails(2)
+        self.start_daemon("-t", "1")
+        # the robot is in its poll loop before the first mail comes in
+        self.wait_mailbox(lambda stats: "NOOP" in stats["commands"])
+        latency = []
+        for count, mail in enumerate(mails, 1):
+            self.mailbox.add(mail)
+            latency.append(self.wait_verified(count))
+        self.assertLess(max(latency), 10)
+        self.assertNotIn("IDLE", self.mailbox.stats["commands"])
+        self.assertIn("NOOP", self.mailbox.stats["commands"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# -*- coding: UTF-8 -*-
+# fetch_patches and process_emails of robot-jenkins.py against the IMAP stand-in: which
+# part of a mail is taken as the patch and which mails are patches
+
+import os
+import shutil
+import imaplib
+import tempfile
+import unittest
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import scripts
+import imap_stand_in
+
+robot = scripts.load("robot_jenkins/robot-jenkins.py")
+
+DIFF = """From: A <a@b.c>
+Subject: [PATCH] f1.txt: change
+
+---
+ f1.txt | 1 +
+diff --git a/f1.txt b/f1.txt
+--- a/f1.txt
++++ b/f1.txt
+@@ -1 +1,2 @@
+ base
++change
+"""
+
+def mail(subject, *parts, references=None):
+    # a multipart mail of (text, filename) parts, filename None for an inline part
+    msg = MIMEMultipart()
+    msg["Subject"] = subject
+    msg["Message-ID"] = "<%s@b.c>" % subject.replace(" ", "-").replace(":", "")
+    if references:
+        msg["References"] = references
+    for text, filename in parts:
+        part = MIMEText(text, "plain")
+        if filename:
+            part.add_header("Content-Disposition", "attachment", filename=filename)
+        msg.attach(part)
+    return msg.as_bytes().replace(b"\n", b"\r\n")
+
+class FetchTest(unittest.TestCase):
+    def setUp(self):
+        self.mailbox = imap_stand_in.Mailbox()
+        listener = imap_stand_in.start(self.mailbox, scripts.CERT_FILE)
+        self.addCleanup(listener.close)
+        self.mail = imaplib.IMAP4_SSL("127.0.0.1", listener.getsockname()[1])
+        self.addCleanup(self.mail.logout)
+        self.mail.login("robot", "pw")
+        self.mail.select("INBOX")
+
+    def patches(self):
+        uids = [m["uid"] for m in self.mailbox.messages]
+        return {uid: content for uid, headers, content in robot.fetch_patches(self.mail, uids)}
+
+    def test_log_attachment(self):
+        # a text/plain attachment other than the .patch is no patch by itself
+        no_diff = self.mailbox.add(mail("[PATCH] no diff", ("see the log", None), ("build log\n", "log.txt")))
+        inline = self.mailbox.add(mail("[PATCH] inline", (DIFF, None), ("build log\n", "log.txt")))
+        attached = self.mailbox.add(mail("[PATCH] attached", ("see the patch", None),
+                                         ("build log\n", "log.txt"), (DIFF, "0001-change.patch")))
+        patches = self.patches()
+        self.assertNotIn(no_diff, patches)
+        self.assertIn("diff --git", patches[inline])
+        self.assertIn("diff --git", patches[attached])
+
+    def test_reply(self):
+        # a review reply quoting the diff of 2/2 does not take the place of 2/2
+        first = mail("[PATCH 1/2] first", (DIFF, None))
+        second = mail("[PATCH 2/2] second", (DIFF.replace("change", "second"), None),
+                      references="<[PATCH-1/2]-first@b.c>")
+        reply = mail("Re: [PATCH 2/2] second", ("".join("> " + line + "\n" for line in DIFF.splitlines()), None),
+                     references="<[PATCH-1/2]-first@b.c> <[PATCH-2/2]-second@b.c>")
+        for raw in (first, second, reply):
+            self.mailbox.add(raw)
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        ledger = robot.PatchLedger(os.path.join(root, "ledger.db"))
+        self.addCleanup(ledger.db.close)
+        files = robot.process_emails(self.mail, root, ledger=ledger)
+        self.assertEqual(len(files), 2)
+        series = ledger.unfinished()
+        self.assertEqual(len(series), 1)
+        with open(series[0][1]) as f:
+            self.assertIn("+second", f.read())
+
+    def test_resend(self):
+        # a [RESEND PATCH] of a diff fetched together with the first copy is saved once
+        self.mailbox.add(mail("[PATCH] change", (DIFF, None)))
+        self.mailbox.add(mail("[RESEND PATCH] change", (DIFF, None)))
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        ledger = robot.PatchLedger(os.path.join(root, "ledger.db"))
+        self.addCleanup(ledger.db.close)
+        self.assertEqual(len(robot.process_emails(self.mail, root, ledger=ledger)), 1)
+        self.assertEqual(len(ledger.unfinished()), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: UTF-8 -*-
+# PatchLedger of robot-jenkins.py: which patch mails count as handled
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import scripts
+
+robot = scripts.load("robot_jenkins/robot-jenkins.py")
+
+class LedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.ledger = robot.PatchLedger(os.path.join(self.root, "ledger.db"))
+        self.addCleanup(self.ledger.db.close)
+
+    def test_seen(self):
+        for stage in ("saved", "applied", "failed", "duplicate", "committed", "pushed", "verified"):
+            self.ledger.add("<%s@b.c>" % stage, "id-" + stage, stage + ".patch")
+            if stage != "saved":
+                self.ledger.update(stage + ".patch", stage)
+        # the same Message-ID is never taken twice
+        self.assertTrue(self.ledger.seen("<failed@b.c>", "other"))
+        # the same diff under another Message-ID unless the first copy failed
+        for stage in ("failed", "duplicate"):
+            self.assertFalse(self.ledger.seen("<resent@b.c>", "id-" + stage))
+        for stage in ("saved", "applied", "committed", "pushed", "verified"):
+            self.assertTrue(self.ledger.seen("<resent@b.c>", "id-" + stage))
+        self.assertFalse(self.ledger.seen("<resent@b.c>", ""))
+
+    def test_duplicate_n(self):
+        self.ledger.add("<1@b.c>", "id-1", "1.patch", "<0@b.c> v1 2", 1, 2)
+        self.ledger.add("<2@b.c>", "id-2", "2.patch", "<0@b.c> v1 2", 2, 2)
+        self.ledger.add("<3@b.c>", "id-3", "3.patch", "<0@b.c> v1 2", 2, 2)
+        self.ledger.add("<4@b.c>", "id-4", "4.patch")
+        self.assertEqual(self.ledger.unfinished(), [["4.patch"]])
+        for patch_file in ("1.patch", "2.patch", "3.patch"):
+            self.assertEqual(self.ledger.get(patch_file)[0], "failed")
+        self.assertEqual(self.ledger.unfinished(), [["4.patch"]])
+
+    def test_partly_verified(self):
+        # one review of a pushed 3/3 series failed, only that change is verified again
+        for n in (1, 2, 3):
+            self.ledger.add("<%d@b.c>" % n, "id-%d" % n, "%d.patch" % n, "<0@b.c> v1 3", n, 3)
+            self.ledger.update("%d.patch" % n, "pushed", change_id=str(100 + n))
+        self.ledger.verified(["101", "102"])
+        self.assertEqual(self.ledger.unfinished(wait=0), [["3.patch"]])
+        self.assertEqual(self.ledger.get("3.patch")[0], "pushed")
+        self.ledger.verified(["103"])
+        self.assertEqual(self.ledger.unfinished(wait=0), [])
+
+    def test_incomplete(self):
+        self.ledger.add("<1@b.c>", "id-1", "1.patch", "<0@b.c> v1 3", 1, 3)
+        self.ledger.add("<2@b.c>", "id-2", "2.patch", "<0@b.c> v1 3", 2, 3)
+        self.assertEqual(self.ledger.unfinished(), [])
+        self.assertEqual(self.ledger.get("1.patch")[0], "saved")
+        self.ledger.add("<3@b.c>", "id-3", "3.patch", "<0@b.c> v1 3", 3, 3)
+        self.assertEqual(self.ledger.unfinished(), [["1.patch", "2.patch", "3.patch"]])
+        self.ledger.add("<5@b.c>", "id-5", "5.patch", "<4@b.c> v1 2", 1, 2)
+        self.assertEqual(self.ledger.unfinished(wait=-1), [["1.patch", "2.patch", "3.patch"]])
+        self.assertEqual(self.ledger.get("5.patch")[0], "failed")
+
+if __name__ == "__main__":
+    unittest.main()